@@ -5,14 +5,13 @@ import sys
 from hiking import commands
 from hiking.arg_parsing import parse_arguments
 from hiking.exceptions import HikingException, HikingJsonLoaderException
-from hiking.import_export import JSON_IMPORT_EXAMPLE
 from hiking.models import create_tables
 from hiking.utils import DATA_HOME, setup_logging
 
 logger = logging.getLogger(__name__)
 
 
-def main():
+def main():  # noqa: C901
     args = parse_arguments(sys.argv[1:])
 
     setup_logging(args.debug)
@@ -31,19 +30,34 @@ def main():
                     args.order_key,
                     args.no_gpx_viewer,
                     args.plot,
+                    args.group_by,
                 )
             case "create" | "edit":
                 commands.command_create_edit(pk=getattr(args, "id", None), gpx=args.gpx)
             case "delete":
                 commands.command_delete(args.ids, args.all, args.force, args.quiet)
             case "import":
-                commands.command_import(args.json_data)
+                commands.command_import(
+                    args.json_data, args.workers, args.batch_size, args.resume
+                )
             case "export":
                 commands.command_export(
-                    args.export_dir, args.ids, args.daterange, args.include_ids
+                    args.export_dir,
+                    args.ids,
+                    args.daterange,
+                    args.include_ids,
+                    args.archive,
                 )
+            case "compress":
+                commands.command_compress()
+            case "rebuild":
+                commands.command_rebuild()
+            case "cache":
+                commands.command_cache(args.action)
 
     except HikingJsonLoaderException as e:
+        from hiking.import_export import JSON_IMPORT_EXAMPLE
+
         msg = f"Invalid data in hiking.json: {e.args[0]}\n\nExpected format:\n{JSON_IMPORT_EXAMPLE}"
         logger.warning(msg)
     except HikingException as e:
@@ -1,17 +1,25 @@
 import argparse
 import datetime
-import json
 import os
+import zipfile
 from itertools import zip_longest
 from pathlib import Path
 from typing import Optional
 
-import gpxpy
 from rich import box
 
-from hiking.import_export import JSON_IMPORT_EXAMPLE
-from hiking.models import Hike
-from hiking.utils import DATA_HOME, DEFAULT_BOX_STYLE, SlimDateRange
+from hiking.db_utils import DB_PROFILES, get_db_pragmas, get_gpx_compressor
+from hiking.exceptions import HikingJsonLoaderException
+from hiking.models import Hike, get_search_query, parse_gpx
+from hiking.utils import (
+    CACHE_SIZE,
+    DATA_HOME,
+    DB_PRAGMAS,
+    DB_PROFILE,
+    DEFAULT_BOX_STYLE,
+    GPX_COMPRESSION,
+    SlimDateRange,
+)
 
 # TODO: find a way to auto-detect this from rich
 BOX_FORMATS = [
@@ -108,23 +116,36 @@ class GPXFileType(argparse.FileType):
     def __call__(self, *args, **kwargs):
         file = super().__call__(*args, **kwargs)
         try:
-            gpx_xml = file.read()
-            gpxpy.parse(gpx_xml)
+            return parse_gpx(file.read())
         except Exception as e:
             msg = f"Cannot read *.gpx file: {e!s}"
             raise argparse.ArgumentTypeError(msg) from e
-        return gpx_xml
 
 
 class JsonFileType(argparse.FileType):
     def __call__(self, *args, **kwargs):
+        from hiking.import_export import JsonArrayReader
+
         file = super().__call__(*args, **kwargs)
         try:
-            data = json.load(file)
-        except Exception as e:
+            if zipfile.is_zipfile(file.name):
+                file.close()
+                reader = JsonArrayReader.from_archive(Path(file.name))
+            else:
+                reader = JsonArrayReader(file)
+            # the hikes are decoded lazily during the import
+            reader.start()
+        except (HikingJsonLoaderException, UnicodeDecodeError, KeyError) as e:
             msg = f"Cannot read *.json file: {e!s}"
             raise argparse.ArgumentTypeError(msg) from e
-        return data
+        return reader
+
+
+def validate_search(value: str) -> str:
+    if not get_search_query(value):
+        msg = "Invalid search query: no search terms"
+        raise argparse.ArgumentTypeError(msg)
+    return value
 
 
 def validate_order_key(value: str) -> tuple[str, bool]:
@@ -132,7 +153,7 @@ def validate_order_key(value: str) -> tuple[str, bool]:
     if value.startswith("-"):
         reverse = True
         value = value.lstrip("-")
-    if value not in get_valid_fields_for_args():
+    if value not in [*get_valid_fields_for_args(), "rank"]:
         msg = "Invalid order_key"
         raise argparse.ArgumentTypeError(msg)
     return value, reverse
@@ -150,6 +171,16 @@ def validate_plot(value: str) -> tuple[str, str]:
         return x, y
 
 
+def validate_positive_int(value: str) -> int:
+    try:
+        number = int(value)
+        assert number > 0
+    except (ValueError, AssertionError) as e:
+        msg = "Must be a positive integer"
+        raise argparse.ArgumentTypeError(msg) from e
+    return number
+
+
 def validate_table_style(value: str) -> tuple[str, str]:
     try:
         box_style = getattr(box, value.upper())
@@ -177,37 +208,22 @@ def set_default_subparser(
             raw_args.insert(0, default_subcommand)
 
 
-def parse_arguments(raw_args: list[str]) -> argparse.Namespace:  # noqa: PLR0915
-    """Parse all arguments."""
-
-    def format_list(data: list[str]):
-        data.sort()
-        col_1 = data[: round(len(data) / 2)]
-        col_2 = data[round(len(data) / 2) :]
-        table_data = list(zip_longest(col_1, col_2, fillvalue=""))
-        longest = 0
-        for i in table_data:
-            longest = max(longest, len(i[0]))
-        result = [f"{i[0].ljust(longest)}{' ' * 5}{i[1]}" for i in table_data]
-        return "\n".join(result)
-
-    parser = argparse.ArgumentParser(
-        formatter_class=argparse.RawTextHelpFormatter, prog="hiking"
-    )
+def format_list(data: list[str]):
+    data.sort()
+    col_1 = data[: round(len(data) / 2)]
+    col_2 = data[round(len(data) / 2) :]
+    table_data = list(zip_longest(col_1, col_2, fillvalue=""))
+    longest = 0
+    for i in table_data:
+        longest = max(longest, len(i[0]))
+    result = [f"{i[0].ljust(longest)}{' ' * 5}{i[1]}" for i in table_data]
+    return "\n".join(result)
 
-    debug_arg_dict = {
-        "help": "Show debug information (log queries)",
-        "action": "store_true",
-    }
 
-    subparsers = parser.add_subparsers(dest="command")
+def add_show_arguments(show: argparse.ArgumentParser):
+    from hiking.collection import PERIODS
 
-    show = subparsers.add_parser(
-        "show",
-        help="Show hike(s) (default)",
-        description="Show hike(s) (default)",
-        formatter_class=argparse.RawTextHelpFormatter,
-    )
+    show.description = "Show hike(s) (default)"
 
     show.add_argument(
         "ids",
@@ -228,8 +244,12 @@ def parse_arguments(raw_args: list[str]) -> argparse.Namespace:  # noqa: PLR0915
     show.add_argument(
         "-s",
         "--search",
-        help="Search for text in name and body (case insensitive)",
-        type=str,
+        help=(
+            "Full-text search in name and body (case insensitive)\n"
+            "Finds hikes with words starting with each search term, "
+            '"hike to" finds these words in this order'
+        ),
+        type=validate_search,
     )
 
     show.add_argument(
@@ -248,6 +268,7 @@ def parse_arguments(raw_args: list[str]) -> argparse.Namespace:  # noqa: PLR0915
         "--order-key",
         help=(
             'Key to use for hike sorting. To reverse, prepend with "-".\n'
+            'Use "rank" to sort by relevance when searching.\n'
             "Available options:\n"
             f"{format_list(get_valid_fields_for_args())}"
         ),
@@ -255,6 +276,17 @@ def parse_arguments(raw_args: list[str]) -> argparse.Namespace:  # noqa: PLR0915
         type=validate_order_key,
     )
 
+    show.add_argument(
+        "--group-by",
+        help=(
+            "Show the stats per period instead of per hike, ordered by date.\n"
+            "Weeks start on Monday.\n"
+            f"Available options:\n{format_list(list(PERIODS))}"
+        ),
+        choices=PERIODS,
+        metavar="PERIOD",
+    )
+
     show.add_argument(
         "-g",
         "--no-gpx-viewer",
@@ -276,14 +308,9 @@ def parse_arguments(raw_args: list[str]) -> argparse.Namespace:  # noqa: PLR0915
         type=validate_plot,
     )
 
-    show.add_argument("--debug", **debug_arg_dict)
 
-    create = subparsers.add_parser(
-        "create",
-        help="Create a new record",
-        description="Create a new record.",
-        formatter_class=argparse.RawTextHelpFormatter,
-    )
+def add_create_arguments(create: argparse.ArgumentParser):
+    create.description = "Create a new record."
 
     create.add_argument(
         "--gpx",
@@ -292,14 +319,9 @@ def parse_arguments(raw_args: list[str]) -> argparse.Namespace:  # noqa: PLR0915
         help="Import from *.gpx-file",
     )
 
-    create.add_argument("--debug", **debug_arg_dict)
 
-    edit = subparsers.add_parser(
-        "edit",
-        help="Edit a record",
-        description="Edit a record.",
-        formatter_class=argparse.RawTextHelpFormatter,
-    )
+def add_edit_arguments(edit: argparse.ArgumentParser):
+    edit.description = "Edit a record."
 
     edit.add_argument(
         "id",
@@ -315,14 +337,9 @@ def parse_arguments(raw_args: list[str]) -> argparse.Namespace:  # noqa: PLR0915
         help="Import from *.gpx-file",
     )
 
-    edit.add_argument("--debug", **debug_arg_dict)
 
-    delete = subparsers.add_parser(
-        "delete",
-        help="Delete records by ID",
-        description="Delete records by ID.",
-        formatter_class=argparse.RawTextHelpFormatter,
-    )
+def add_delete_arguments(delete: argparse.ArgumentParser):
+    delete.description = "Delete records by ID."
 
     delete.add_argument(
         "-f",
@@ -353,31 +370,51 @@ def parse_arguments(raw_args: list[str]) -> argparse.Namespace:  # noqa: PLR0915
         type=int,
     )
 
-    delete.add_argument("--debug", **debug_arg_dict)
 
-    _import = subparsers.add_parser(
-        "import",
-        help="Import records from JSON",
-        description=f"Import records from JSON.\nFormat:\n{JSON_IMPORT_EXAMPLE}",
-        formatter_class=argparse.RawTextHelpFormatter,
-    )
+def add_import_arguments(_import: argparse.ArgumentParser):
+    from hiking.import_export import IMPORT_BATCH_SIZE, JSON_IMPORT_EXAMPLE
+
+    _import.description = f"Import records from JSON.\nFormat:\n{JSON_IMPORT_EXAMPLE}"
 
     _import.add_argument(
         "json_data",
         metavar="JSON_FILE",
-        help="Path to JSON file",
-        type=JsonFileType("r"),
+        help='Path to JSON file, or to archive created by "export --archive"',
+        type=JsonFileType("r", encoding="utf-8"),
     )
 
-    _import.add_argument("--debug", **debug_arg_dict)
+    _import.add_argument(
+        "-w",
+        "--workers",
+        help=(
+            "Number of processes reading GPX files, worth it for many large GPX "
+            "files (default: 1, reading them in this process)"
+        ),
+        default=1,
+        type=validate_positive_int,
+    )
 
-    export = subparsers.add_parser(
-        "export",
-        help="Export records as JSON and GPX",
-        description="Export records as JSON and GPX.",
-        formatter_class=argparse.RawTextHelpFormatter,
+    _import.add_argument(
+        "-b",
+        "--batch-size",
+        help=f"Number of hikes committed at once (default: {IMPORT_BATCH_SIZE})",
+        default=IMPORT_BATCH_SIZE,
+        type=validate_positive_int,
+    )
+
+    _import.add_argument(
+        "-r",
+        "--resume",
+        help="Skip the hikes imported by a previous, failed import of the file",
+        action="store_true",
     )
 
+
+def add_export_arguments(export: argparse.ArgumentParser):
+    from hiking.import_export import ARCHIVE_NAME
+
+    export.description = "Export records as JSON and GPX."
+
     export.add_argument(
         "export_dir",
         metavar="EXPORT_DIR",
@@ -408,10 +445,91 @@ def parse_arguments(raw_args: list[str]) -> argparse.Namespace:  # noqa: PLR0915
         action="store_true",
     )
 
-    export.add_argument("--debug", **debug_arg_dict)
+    export.add_argument(
+        "--archive",
+        help=f"Export to a single compressed file {ARCHIVE_NAME} in EXPORT_DIR",
+        action="store_true",
+    )
+
+
+def add_compress_arguments(compress: argparse.ArgumentParser):
+    compress.description = (
+        "Compress the stored GPX data of all hikes in place.\n"
+        'The algorithm can be set with HIKING_GPX_COMPRESSION ("zlib" or "lzma").'
+    )
+
+
+def add_rebuild_arguments(rebuild: argparse.ArgumentParser):
+    rebuild.description = (
+        "Rebuild the totals of the hikes per day, month and year from all hikes.\n"
+        "They are kept up to date by all commands, this is only needed if the\n"
+        "database was changed by other means."
+    )
+
+
+def add_cache_arguments(cache: argparse.ArgumentParser):
+    cache.description = (
+        "Manage the cache of tracks read from imported GPX files and of rendered\n"
+        "elevation profiles.\n"
+        "Its size in MiB is limited with HIKING_CACHE_SIZE (default: 256)."
+    )
+    cache.add_argument(
+        "action",
+        choices=["stats", "clear"],
+        help="Show statistics of the cache or remove all entries",
+    )
+
+
+# Help text and function adding the arguments of each subcommand. Only the
+# arguments of the invoked subcommand are added, the others are never used.
+SUBCOMMANDS = {
+    "show": ("Show hike(s) (default)", add_show_arguments),
+    "create": ("Create a new record", add_create_arguments),
+    "edit": ("Edit a record", add_edit_arguments),
+    "delete": ("Delete records by ID", add_delete_arguments),
+    "import": ("Import records from JSON", add_import_arguments),
+    "export": ("Export records as JSON and GPX", add_export_arguments),
+    "compress": ("Compress stored GPX data", add_compress_arguments),
+    "rebuild": ("Rebuild the totals per period", add_rebuild_arguments),
+    "cache": ("Manage the cache", add_cache_arguments),
+}
+
+
+def parse_arguments(raw_args: list[str]) -> argparse.Namespace:
+    """Parse all arguments."""
+
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.RawTextHelpFormatter,
+        prog="hiking",
+        epilog=(
+            "SQLite performance profile, set with HIKING_DB_PROFILE:\n"
+            "  interactive  default\n"
+            "  bulk_import  always used by import\n"
+            "  reporting    read-only with a larger cache, for stats and plots over\n"
+            "               many hikes\n"
+            "Single pragmas can be overridden with HIKING_DB_PRAGMAS, e.g.\n"
+            '"cache_size=-65536,mmap_size=0". Available pragmas:\n'
+            f"{', '.join(DB_PROFILES['interactive'])}"
+        ),
+    )
+
+    subparsers = parser.add_subparsers(dest="command")
+    for name, (help_text, _) in SUBCOMMANDS.items():
+        subparsers.add_parser(
+            name, help=help_text, formatter_class=argparse.RawTextHelpFormatter
+        )
 
     set_default_subparser(parser, "show", raw_args)
 
+    if raw_args and raw_args[0] in SUBCOMMANDS:
+        subparser = subparsers.choices[raw_args[0]]
+        SUBCOMMANDS[raw_args[0]][1](subparser)
+        subparser.add_argument(
+            "--debug",
+            help="Show debug information (log queries)",
+            action="store_true",
+        )
+
     args = parser.parse_args(raw_args)
 
     if args.command == "delete" and not args.ids and not args.all:
@@ -420,6 +538,21 @@ def parse_arguments(raw_args: list[str]) -> argparse.Namespace:  # noqa: PLR0915
     if args.command == "delete" and args.ids and args.all:
         msg = "Ambiguous argument: IDs and --all provided"
         raise parser.error(msg)
+    if args.command == "show" and args.group_by and args.order_key[0] != "date":
+        msg = 'Periods of --group-by can only be ordered by "date"'
+        raise parser.error(msg)
+    if args.command == "show" and args.order_key[0] == "rank" and not args.search:
+        msg = 'Ordering by "rank" requires --search'
+        raise parser.error(msg)
+
+    from hiking.cache import get_cache_size
+
+    try:
+        get_db_pragmas(DB_PROFILE, DB_PRAGMAS)
+        get_cache_size(CACHE_SIZE)
+        get_gpx_compressor(GPX_COMPRESSION)
+    except ValueError as e:
+        raise parser.error(str(e)) from e
 
     try:
         WritableDirPathType()(DATA_HOME.parent)
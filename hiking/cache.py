@@ -0,0 +1,142 @@
+import hashlib
+import logging
+import mmap
+import os
+import struct
+import tempfile
+from collections.abc import Callable
+from pathlib import Path
+from typing import Optional
+
+from hiking.track import Track, read_gpx
+from hiking.utils import CACHE_DIR, CACHE_SIZE
+
+logger = logging.getLogger(__name__)
+
+# Cached tracks are stored with `Track.to_bytes()`, which can be read in place
+TRACK_SUFFIX = ".track"
+# Rendered plots of tracks, as printed
+PLOT_SUFFIX = ".plot"
+# Bump to invalidate the cached plots when the rendering changes
+PLOT_VERSION = 1
+
+
+def get_cache_size(value: str) -> int:
+    """Size limit of the cache in bytes, from a value in MiB."""
+    if not value.isdigit():
+        msg = f'Invalid cache size "{value}"'
+        raise ValueError(msg)
+    return int(value) * 2**20
+
+
+def get_cache_path(xml: str) -> Path:
+    digest = hashlib.sha256(xml.encode()).hexdigest()
+    return CACHE_DIR / f"{digest}{TRACK_SUFFIX}"
+
+
+def load_track(path: Path) -> Optional[Track]:
+    """Read the cached track at `path`, `None` if it's missing or unreadable."""
+    try:
+        with (
+            path.open("rb") as f,
+            mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data,
+        ):
+            track = Track.from_bytes(data)
+        # the modification time orders the entries for the eviction
+        os.utime(path)
+    except (OSError, ValueError, BufferError, struct.error):
+        return None
+    return track
+
+
+def store_entry(path: Path, data: bytes):
+    """Write `data` atomically, failing silently: the cache is optional."""
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with tempfile.NamedTemporaryFile(
+            dir=path.parent, suffix=".tmp", delete=False
+        ) as f:
+            f.write(data)
+        Path(f.name).replace(path)
+    except OSError:
+        logger.debug("Cannot write cache entry %s", path, exc_info=True)
+
+
+def get_track(xml: str) -> Track:
+    """Track read from the GPX data `xml`, cached by its content."""
+    path = get_cache_path(xml)
+    track = load_track(path)
+    if track is None:
+        track = read_gpx(xml).track
+        store_entry(path, track.to_bytes())
+    return track
+
+
+def get_plot(
+    track: Track, width: int, height: int, color_mode: str, render: Callable[[], str]
+) -> str:
+    """
+    Plot of `track` from `render`, cached by the track and the plot settings.
+
+    Changed GPX data results in a different track and thus in a new entry, the
+    outdated one is evicted eventually.
+    """
+    digest = hashlib.sha256(track.to_bytes())
+    digest.update(f"{width}x{height} {color_mode} {PLOT_VERSION}".encode())
+    path = CACHE_DIR / f"{digest.hexdigest()}{PLOT_SUFFIX}"
+    try:
+        rendered = path.read_text()
+        os.utime(path)
+    except (OSError, UnicodeDecodeError):
+        rendered = render()
+        store_entry(path, rendered.encode())
+        prune_cache()
+    return rendered
+
+
+def get_cache_entries() -> list[tuple[Path, os.stat_result]]:
+    """List the cached tracks and plots, least recently used first."""
+    if not CACHE_DIR.is_dir():
+        return []
+    entries = []
+    for path in CACHE_DIR.iterdir():
+        if path.suffix not in (TRACK_SUFFIX, PLOT_SUFFIX):
+            continue
+        try:
+            entries.append((path, path.stat()))
+        except FileNotFoundError:  # pragma: no cover
+            # evicted by another process in the meantime
+            continue
+    return sorted(entries, key=lambda entry: entry[1].st_mtime)
+
+
+def prune_cache(max_size: Optional[int] = None) -> int:
+    """Evict the least recently used entries down to `max_size` bytes."""
+    max_size = get_cache_size(CACHE_SIZE) if max_size is None else max_size
+    entries = get_cache_entries()
+    size = sum(stat.st_size for _, stat in entries)
+    removed = 0
+    for path, stat in entries:
+        if size <= max_size:
+            break
+        path.unlink(missing_ok=True)
+        size -= stat.st_size
+        removed += 1
+    return removed
+
+
+def clear_cache() -> int:
+    return prune_cache(max_size=0)
+
+
+def get_cache_stats() -> dict:
+    entries = get_cache_entries()
+    size = sum(stat.st_size for _, stat in entries)
+    return {
+        "Name": "Track cache",
+        "Directory": str(CACHE_DIR),
+        "Tracks": sum(path.suffix == TRACK_SUFFIX for path, _ in entries),
+        "Plots": sum(path.suffix == PLOT_SUFFIX for path, _ in entries),
+        "Size": f"{size / 2**20:.1f} MiB",
+        "Limit": f"{get_cache_size(CACHE_SIZE) / 2**20:.0f} MiB",
+    }
@@ -1,71 +1,133 @@
 import datetime
 from dataclasses import dataclass
-from typing import Union
+from typing import Optional, Union
 
-from sqlalchemy import Interval, func
+from sqlalchemy import func, type_coerce
 from sqlalchemy.orm import Query
 
-from hiking.models import Hike
-from hiking.utils import format_value
+from hiking.db_utils import session
+from hiking.models import (
+    HIKE_ROLLUPS,
+    HIKES_FTS,
+    ROLLUP_FUNCTIONS,
+    ROLLUP_PERIODS,
+    Hike,
+)
+from hiking.utils import SlimDateRange, format_value
+
+CALCULATIONS = [
+    ("sum", "Σ "),
+    ("avg", "⌀ "),
+    ("max", "↑ "),
+    ("min", "↓ "),
+]
+
+AGGREGATE_FUNCTIONS = {
+    "sum": func.sum,
+    "avg": func.avg,
+    "max": func.max,
+    "min": func.min,
+}
+
+
+# `strftime` formats bucketing dates into periods, their text sorts chronologically.
+# Weeks start on Monday, days before the first Monday of a year are in week 00.
+PERIODS = {
+    "week": "%Y-W%W",
+    **{period: ROLLUP_PERIODS[period] for period in ("month", "year")},
+}
+
+
+def aggregate_expression(calc: str, attr: str):
+    expression = getattr(Hike, attr)
+    # Keep the type of the field, so e.g. `duration` results in a `timedelta`
+    return AGGREGATE_FUNCTIONS[calc](expression, type_=expression.type)
+
+
+def rollup_expression(calc: str, attr: str):
+    """Like `aggregate_expression`, combining the rollups of `HIKE_ROLLUPS`."""
+    columns = HIKE_ROLLUPS.c
+    expression_type = getattr(Hike, attr).type
+    if calc == "avg":
+        # `total` is always a float, so the division is too
+        return type_coerce(
+            func.total(columns[f"sum_{attr}"]) / func.total(columns[f"count_{attr}"]),
+            expression_type,
+        )
+    combine = ROLLUP_FUNCTIONS[calc][1]
+    return combine(columns[f"{calc}_{attr}"], type_=expression_type)
+
+
+def get_aggregate_keys() -> list[tuple[str, str]]:
+    """`(calc, attr)` of all supported calculations of all fields."""
+    return [
+        (calc, field.info["name"])
+        for field in Hike.FIELDS
+        for calc, _ in CALCULATIONS
+        if calc in field.info["supported_calculations"]
+    ]
+
+
+def get_summary_cells(results: dict[tuple[str, str], object]) -> list[dict]:
+    """Format the results of `HikeCollection.aggregate` for the summarized fields."""
+
+    def get_summary_cell(attr: str, supported_calculations: list[str]):
+        cell = {}
+        for calc, pretty_calc in CALCULATIONS:
+            cell[pretty_calc] = "-"
+            if calc in supported_calculations:
+                cell[pretty_calc] = format_value(results[(calc, attr)], attr)
+        return cell
+
+    return [
+        get_summary_cell(field.info["name"], field.info["supported_calculations"])
+        for field in Hike.FIELDS
+        if field.info["supported_calculations"]
+    ]
 
 
 @dataclass
 class HikeCollection:
     hikes: Query
+    # Set if `hikes` are all hikes within the range, their stats are then combined
+    # from the rollups instead of aggregating the hikes
+    daterange: Optional[SlimDateRange] = None
 
     def get_hikes_attr_list(
         self, attr: str
     ) -> list[Union[float, int, datetime.date, datetime.timedelta]]:
-        return [getattr(hike, attr) for hike in self.hikes.all()]
+        # order explicitly, so lists of different attributes line up
+        return [getattr(hike, attr) for hike in self.hikes.order_by(Hike.id)]
 
     def sum(self, attr: str) -> Union[float, int, datetime.date, datetime.timedelta]:
-        is_interval = isinstance(getattr(Hike, attr).expression.type, Interval)
-        if getattr(Hike, attr).info["calculated_value"] or is_interval:
-            attr_list = self.get_hikes_attr_list(attr)
-            if is_interval:
-                return sum(attr_list, datetime.timedelta())
-
-            return sum(attr_list)  # pragma: no cover
-
-        return self.hikes.with_entities(func.sum(getattr(Hike, attr))).scalar()
+        return self.hikes.with_entities(aggregate_expression("sum", attr)).scalar()
 
     def avg(self, attr: str) -> Union[float, datetime.timedelta]:
-        if attr == "duration":
-            return (
-                sum([h.duration for h in self.hikes.all()], datetime.timedelta())
-                / self.hikes.count()
-            )
-        if attr == "speed":
-            return sum(getattr(h, attr) for h in self.hikes.all()) / self.hikes.count()
-
-        return self.hikes.with_entities(func.avg(getattr(Hike, attr))).scalar()
+        return self.hikes.with_entities(aggregate_expression("avg", attr)).scalar()
 
     def max(self, attr: str) -> Union[float, int, datetime.date, datetime.timedelta]:
-        if attr == "speed":
-            return sorted(self.hikes.all(), key=lambda x: x.speed, reverse=True)[
-                0
-            ].speed
-
-        return getattr(
-            self.hikes.order_by(getattr(Hike, attr).desc()).limit(1).first(), attr
-        )
+        return self.get_first_value(attr, getattr(Hike, attr).desc())
 
     def min(self, attr: str) -> Union[float, int, datetime.date, datetime.timedelta]:
-        if attr == "speed":
-            return sorted(self.hikes.all(), key=lambda x: x.speed)[0].speed
+        return self.get_first_value(attr, getattr(Hike, attr).asc())
 
-        return getattr(
-            self.hikes.order_by(getattr(Hike, attr).asc()).limit(1).first(), attr
+    def get_first_value(
+        self, attr: str, order_by
+    ) -> Union[float, int, datetime.date, datetime.timedelta, None]:
+        # NULL values are ignored, like by the SQL aggregate functions
+        hike = (
+            self.hikes.filter(getattr(Hike, attr).is_not(None))
+            .order_by(order_by)
+            .first()
         )
+        return getattr(hike, attr) if hike else None
 
     def get_hikes_stats(self, order_params: tuple[str, bool]) -> list[list[str]]:
-        if order_params[0] == "speed":
-            hike_list = sorted(
-                self.hikes.all(), key=lambda x: x.speed, reverse=order_params[1]
-            )
-            return [hike.get_stats() for hike in hike_list]
-
-        order = getattr(Hike, order_params[0])
+        if order_params[0] == "rank":
+            # relevance of the full-text search, only available when searching
+            order = HIKES_FTS.c.rank
+        else:
+            order = getattr(Hike, order_params[0])
         if order_params[1]:
             order = order.desc()
         query = self.hikes.order_by(order)
@@ -75,37 +137,115 @@ class HikeCollection:
         result = getattr(self, calc)(attr)
         return format_value(result, attr)
 
-    def get_totals(self) -> list[str]:
-        def get_summary_cell(attr: str, supported_calculations: list[str]):
-            cell = {}
-            for calc, pretty_calc in [
-                ("sum", "Σ "),
-                ("avg", "⌀ "),
-                ("max", "↑ "),
-                ("min", "↓ "),
-            ]:
-                cell[pretty_calc] = "-"
-                if calc in supported_calculations:
-                    cell[pretty_calc] = self.calc_and_format_value(calc, attr)
-            return cell
+    def aggregate(self) -> tuple[int, dict[tuple[str, str], object]]:
+        """
+        Calculate all supported calculations of all fields in a single query.
 
-        return [
-            "",
-            "STATS",
-            str(self.hikes.count()),
-            *[
-                get_summary_cell(
-                    field.info["name"], field.info["supported_calculations"]
+        Returns the number of hikes and a dict mapping `(calc, attr)` to the result.
+        """
+        keys = get_aggregate_keys()
+        query, _, entities = self.get_aggregates_query("year", keys)
+        row = query.with_entities(*entities).one()
+
+        return row[0], dict(zip(keys, row[1:], strict=True))
+
+    def query_rollups(self, period: str) -> tuple[Query, bool]:
+        """
+        Query the rollups of `period` of the hikes in `daterange`.
+
+        Periods without rollups and bounded date ranges are covered by the rollups
+        per day instead. Returns whether the rollups are of `period` with the query.
+        """
+        columns = HIKE_ROLLUPS.c
+        query = session.query(HIKE_ROLLUPS)
+        unbounded = tuple(self.daterange) == (datetime.date.min, datetime.date.max)
+        if unbounded and period in ROLLUP_PERIODS:
+            return query.filter(columns.period == period), True
+
+        query = query.filter(columns.period == "day")
+        if not unbounded:
+            query = query.filter(
+                columns.bucket.between(
+                    self.daterange.lower.isoformat(), self.daterange.upper.isoformat()
                 )
-                for field in Hike.FIELDS
-                if field.info["supported_calculations"]
+            )
+        return query, period == "day"
+
+    def get_aggregates_query(
+        self, period: str, keys: list[tuple[str, str]]
+    ) -> tuple[Query, object, list]:
+        """
+        Query, bucket of `period` and aggregates of the hikes for `keys`.
+
+        The aggregates start with the number of hikes and are read from the
+        rollups if possible.
+        """
+        if not self.daterange:
+            return (
+                self.hikes,
+                func.strftime(PERIODS[period], Hike.date),
+                [
+                    func.count(Hike.id),
+                    *[aggregate_expression(calc, attr) for calc, attr in keys],
+                ],
+            )
+
+        query, of_period = self.query_rollups(period)
+        bucket = HIKE_ROLLUPS.c.bucket
+        return (
+            query,
+            bucket if of_period else func.strftime(PERIODS[period], bucket),
+            [
+                func.coalesce(func.sum(HIKE_ROLLUPS.c.count_id), 0),
+                *[rollup_expression(calc, attr) for calc, attr in keys],
             ],
+        )
+
+    def aggregate_by_period(
+        self, period: str, reverse: bool = False
+    ) -> list[tuple[str, int, dict[tuple[str, str], object]]]:
+        """
+        Calculate the results of `aggregate` per period in a single query.
+
+        `period` is a key of `PERIODS`. Returns the period, the number of hikes and
+        the results for every period with hikes, in chronological order.
+        """
+        keys = get_aggregate_keys()
+        query, bucket, entities = self.get_aggregates_query(period, keys)
+        rows = (
+            query.with_entities(bucket, *entities)
+            .group_by(bucket)
+            .order_by(bucket.desc() if reverse else bucket)
+        )
+
+        return [(row[0], row[1], dict(zip(keys, row[2:], strict=True))) for row in rows]
+
+    def get_period_stats(self, period: str, reverse: bool = False) -> list[list]:
+        return [
+            ["", label, str(count), *get_summary_cells(results)]
+            for label, count, results in self.aggregate_by_period(period, reverse)
         ]
 
+    def get_totals(self) -> list[str]:
+        count, results = self.aggregate()
+        return ["", "STATS", str(count), *get_summary_cells(results)]
+
     def get_collection_stats(
-        self, order_params: tuple[str, bool], add_totals: bool = True
+        self,
+        order_params: tuple[str, bool],
+        add_totals: bool = True,
+        group_by: Optional[str] = None,
     ) -> tuple[list, list]:
-        stats = self.get_hikes_stats(order_params)
+        """
+        Stats of the hikes, or of the periods given by `group_by`, and the totals.
+
+        Periods are ordered by date, reversed with `order_params`.
+        """
+        stats = (
+            self.get_period_stats(group_by, reverse=order_params[1])
+            if group_by
+            else self.get_hikes_stats(order_params)
+        )
 
         result = [
             *stats,
@@ -113,7 +253,7 @@ class HikeCollection:
 
         footer = None
         if add_totals and len(stats) > 1:
-            # Only add totals if more than one hike is present
+            # Only add totals if more than one hike or period is present
             footer = self.get_totals()
 
         return result, footer
@@ -1,56 +1,72 @@
+from collections.abc import Iterable
 from pathlib import Path
-from typing import Optional
+from typing import Optional, Union
 
 from rich import box
-from rich.markdown import Markdown
 from rich.prompt import Confirm
 from rich.table import Table
 
 from hiking.collection import HikeCollection
-from hiking.db_utils import session
-from hiking.exceptions import HikingException
-from hiking.gpx import get_elevation_profile
-from hiking.import_export import json_exporter, json_importer
-from hiking.interactivity import display_gpx, user_create_edit_interaction
-from hiking.models import Hike, get_filtered_query
-from hiking.plot import plot
+from hiking.db_utils import session, use_db_profile
+from hiking.exceptions import HikingException, HikingJsonLoaderException
+from hiking.models import (
+    Hike,
+    ParsedGPX,
+    compress_gpx_data,
+    get_filtered_query,
+    rebuild_rollups,
+)
 from hiking.utils import DEFAULT_BOX_STYLE, SlimDateRange, console
 
 
+def get_grid(content: Union[str, dict]) -> Union[str, Table]:
+    if isinstance(content, str):
+        return content
+
+    grid = Table.grid(expand=True)
+    grid.add_column()
+    grid.add_column(justify="right")
+    for k, v in content.items():
+        grid.add_row(k, v)
+    return grid
+
+
 def get_table(
     collection: HikeCollection,
     order_params: tuple[str, bool],
     table_style: box.Box = box.SIMPLE,
     add_totals: bool = True,
+    group_by: Optional[str] = None,
 ) -> Table:
-    data, footer = collection.get_collection_stats(order_params, add_totals=add_totals)
+    data, footer = collection.get_collection_stats(
+        order_params, add_totals=add_totals, group_by=group_by
+    )
     headers = {field.info["name"]: field.info["pretty_name"] for field in Hike.FIELDS}
 
     arrow = "▲" if order_params[1] else "▼"
-    headers[order_params[0]] = f"{headers[order_params[0]]} {arrow}"
+    if order_params[0] in headers:
+        headers[order_params[0]] = f"{headers[order_params[0]]} {arrow}"
 
     table = Table(
-        title="Hikes",
+        title=f"Hikes per {group_by}" if group_by else "Hikes",
         show_header=True,
         show_footer=bool(footer),
         header_style="bold",
         box=table_style,
     )
 
-    def get_grid(content: dict):
-        if isinstance(content, str):
-            return content
-
-        grid = Table.grid(expand=True)
-        grid.add_column()
-        grid.add_column(justify="right")
-        for k, v in content.items():
-            grid.add_row(k, v)
-        return grid
-
     table.add_column("ID", justify="right", footer=footer and get_grid(footer[0]))
-    table.add_column("Date", justify="left", footer=footer and get_grid(footer[1]))
-    table.add_column("Name", justify="left", footer=footer and get_grid(footer[2]))
+    # rows of periods have the period as date and the number of hikes as name
+    table.add_column(
+        group_by.capitalize() if group_by else "Date",
+        justify="left",
+        footer=footer and get_grid(footer[1]),
+    )
+    table.add_column(
+        "Hikes" if group_by else "Name",
+        justify="left",
+        footer=footer and get_grid(footer[2]),
+    )
     table.add_column("➡ km", justify="right", footer=footer and get_grid(footer[3]))
     table.add_column("⬈ m", justify="right", footer=footer and get_grid(footer[4]))
     table.add_column("⬊ m", justify="right", footer=footer and get_grid(footer[5]))
@@ -58,7 +74,7 @@ def get_table(
     table.add_column("km/h", justify="right", footer=footer and get_grid(footer[7]))
 
     for d in data:
-        table.add_row(*d)
+        table.add_row(*[get_grid(cell) for cell in d])
 
     return table
 
@@ -66,6 +82,8 @@ def get_table(
 def draw_plot(
     collection: HikeCollection, x_attr: str = "date", y_attr: str = "distance"
 ):
+    from hiking.plot import plot
+
     x = collection.get_hikes_attr_list(x_attr)
     y = collection.get_hikes_attr_list(y_attr)
     return plot(
@@ -77,12 +95,14 @@ def draw_plot(
     )
 
 
-def command_create_edit(pk: Optional[int] = None, gpx: Optional[str] = None):
+def command_create_edit(pk: Optional[int] = None, gpx: Optional[ParsedGPX] = None):
     """
     Create or edit a record.
 
     If `pk` is provided, `edit` will be performed.
     """
+    from hiking.interactivity import user_create_edit_interaction
+
     hike = session.get(Hike, pk) if pk is not None else Hike()
 
     if not hike:
@@ -143,15 +163,83 @@ def command_delete(ids: list[int], delete_all: bool, force: bool, quiet: bool):
         hike.delete()
 
 
-def command_import(json_data: list[dict]):
-    json_importer(json_data)
+def command_import(
+    json_data: Iterable[dict],
+    workers: int = 1,
+    batch_size: Optional[int] = None,
+    resume: bool = False,
+):
+    from hiking.cache import prune_cache
+    from hiking.import_export import IMPORT_BATCH_SIZE, JsonArrayReader, json_importer
+    from hiking.progress import import_progress
+
+    reader = json_data if isinstance(json_data, JsonArrayReader) else None
+    with import_progress() as progress:
+        task = progress.add_task("import", total=reader and reader.size, hikes=0)
+
+        def on_batch(imported: int):
+            position = reader.position if reader else 0
+            if imported:
+                progress.update(task, completed=position, hikes=imported)
+            else:
+                # don't count the hikes skipped when resuming
+                progress.reset(task, completed=position, hikes=0)
+
+        try:
+            with use_db_profile("bulk_import"):
+                json_importer(
+                    json_data,
+                    batch_size or IMPORT_BATCH_SIZE,
+                    workers,
+                    resume,
+                    on_batch,
+                )
+        except HikingJsonLoaderException:
+            imported = progress.tasks[0].fields["hikes"]
+            if imported and reader and reader.path:
+                console.print(
+                    f"{imported} hikes were imported. Fix the file and use "
+                    "--resume to import the remaining hikes."
+                )
+            raise
+        finally:
+            prune_cache()
 
 
 def command_export(
-    export_dir: Path, ids: list[int], daterange: "SlimDateRange", include_ids: bool
+    export_dir: Path,
+    ids: list[int],
+    daterange: "SlimDateRange",
+    include_ids: bool,
+    archive: bool = False,
 ):
+    from hiking.import_export import json_exporter
+
     query = get_filtered_query(ids=ids, daterange=daterange, load_all_columns=True)
-    json_exporter(query, export_dir, include_ids)
+    json_exporter(query, export_dir, include_ids, archive=archive)
+
+
+def command_compress():
+    count = compress_gpx_data()
+    console.print(f"Compressed GPX data of {count} hikes")
+
+
+def command_rebuild():
+    counts = rebuild_rollups()
+    console.print(
+        f"Rebuilt the totals of {counts.get('day', 0)} days, "
+        f"{counts.get('month', 0)} months and {counts.get('year', 0)} years"
+    )
+
+
+def command_cache(action: str):
+    from hiking.cache import clear_cache, get_cache_stats
+
+    if action == "clear":
+        count = clear_cache()
+        console.print(f"Removed {count} cache entries")
+        return
+    print_detail_stats(get_cache_stats())
 
 
 def print_detail_stats(stats: dict, table_style: box = DEFAULT_BOX_STYLE):
@@ -163,6 +251,11 @@ def print_detail_stats(stats: dict, table_style: box = DEFAULT_BOX_STYLE):
 
 
 def detail_view(hike: Hike, ask_gpx_viewer: bool):
+    from rich.markdown import Markdown
+
+    from hiking.gpx import get_elevation_profile
+    from hiking.interactivity import display_gpx
+
     stats = hike.get_detail_stats()
 
     print_detail_stats(stats)
@@ -188,23 +281,28 @@ def command_show(
     order_params: tuple[str, bool],
     no_gpx_viewer: bool,
     plot_params: tuple[Optional[str], Optional[str]],
+    group_by: Optional[str] = None,
 ) -> None:
     if not session.query(Hike).first():
         msg = 'No hikes in DB. Add some hikes with "create" or "import"'
         raise HikingException(msg)
 
-    collection = HikeCollection(hikes=get_filtered_query(ids, daterange, search))
+    collection = HikeCollection(
+        hikes=get_filtered_query(ids, daterange, search),
+        # without filters, the stats are read from the rollups
+        daterange=None if ids or search else daterange,
+    )
     if not collection.hikes.first():
         msg = "No hikes found with given parameters"
         raise HikingException(msg)
 
     if len(ids) != 1:
-        table = get_table(collection, order_params, table_style)
+        table = get_table(collection, order_params, table_style, group_by=group_by)
         console.print(table)
 
     if len(ids) == 1:
         hike = collection.hikes.first()
-        ask_gpx_viewer = hike.gpx_xml and not no_gpx_viewer
+        ask_gpx_viewer = hike.gpx_data is not None and not no_gpx_viewer
         detail_view(hike, ask_gpx_viewer)
 
     if plot_params:
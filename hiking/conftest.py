@@ -6,10 +6,16 @@ from pathlib import Path
 import pytest
 from pytest_factoryboy.fixture import register
 
-from hiking import __main__, factories
+from hiking import __main__, cache, factories
 from hiking.collection import HikeCollection
 from hiking.db_utils import session
-from hiking.models import Hike, create_tables, get_filtered_query
+from hiking.models import (
+    HIKE_ROLLUPS,
+    Hike,
+    ImportCheckpoint,
+    create_tables,
+    get_filtered_query,
+)
 from hiking.utils import setup_logging
 
 OWN_DIR = Path(__file__).resolve().parent
@@ -31,6 +37,9 @@ def clear_db():
         yield
     finally:
         session.query(Hike).delete()
+        session.query(ImportCheckpoint).delete()
+        # bulk deletes don't update the rollups
+        session.execute(HIKE_ROLLUPS.delete())
         session.commit()
 
 
@@ -97,3 +106,9 @@ def sys_argv():
 @pytest.fixture(autouse=True)
 def mock_data_home(mocker):
     mocker.patch.object(__main__, "DATA_HOME")
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(cache, "CACHE_DIR", tmp_path / "cache")
+    return tmp_path / "cache"
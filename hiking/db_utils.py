@@ -1,9 +1,18 @@
+import datetime
+import functools
+import logging
+import lzma
 import os
+import re
+import zlib
+from collections.abc import Callable, Iterator
+from contextlib import contextmanager
 
-from sqlalchemy import create_engine
+from sqlalchemy import Integer, LargeBinary, TypeDecorator, create_engine, event
 from sqlalchemy.orm import declarative_base, sessionmaker
 
-from hiking.utils import DB_PATH
+from hiking.track import Track
+from hiking.utils import DB_PATH, DB_PRAGMAS, DB_PROFILE, GPX_COMPRESSION
 
 Base = declarative_base()
 engine = create_engine(
@@ -11,5 +20,195 @@ engine = create_engine(
     if not os.environ.get("HIKING_TEST")
     else "sqlite://"
 )
+
+
+@event.listens_for(engine, "connect")
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    # needed for `ON DELETE CASCADE`
+    cursor.execute("PRAGMA foreign_keys=ON")
+    cursor.close()
+
+
+# Performance related pragmas applied to connections, selected with
+# `HIKING_DB_PROFILE`. A negative `cache_size` is in KiB, `mmap_size` is in bytes.
+DB_PROFILES = {
+    # default, for short invocations reading or writing a few hikes
+    "interactive": {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "cache_size": -16384,
+        "mmap_size": 2**26,
+        "temp_store": "MEMORY",
+        "query_only": "OFF",
+    },
+    # used by `import`: large transactions without waiting for the disk. A crash of
+    # the OS (not of the import) may corrupt the database.
+    "bulk_import": {
+        "journal_mode": "WAL",
+        "synchronous": "OFF",
+        "cache_size": -262144,
+        "mmap_size": 2**30,
+        "temp_store": "MEMORY",
+        "query_only": "OFF",
+    },
+    # for stats and plots over many hikes: large read cache, memory mapped database.
+    # Read-only, writes fail.
+    "reporting": {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "cache_size": -131072,
+        "mmap_size": 2**30,
+        "temp_store": "MEMORY",
+        "query_only": "ON",
+    },
+}
+
+db_profile = DB_PROFILE
+
+
+def get_db_pragmas(profile: str, overrides: str = "") -> dict:
+    """Pragmas of `profile`, updated with `overrides` given as "name=value,..."."""
+    if profile not in DB_PROFILES:
+        msg = f'Unknown database profile "{profile}"'
+        raise ValueError(msg)
+
+    pragmas = dict(DB_PROFILES[profile])
+    for override in filter(None, overrides.split(",")):
+        name, _, value = (part.strip() for part in override.partition("="))
+        # values end up in the statement, pragmas cannot be parametrized
+        if name not in pragmas or not re.fullmatch(r"-?\w+", value):
+            msg = f'Invalid database pragma "{override}"'
+            raise ValueError(msg)
+        pragmas[name] = value
+    return pragmas
+
+
+@event.listens_for(engine, "checkout")
+def apply_db_profile(dbapi_connection, connection_record, connection_proxy):
+    """Apply the pragmas of `db_profile`, unless already done for this connection."""
+    if connection_record.info.get("db_profile") == db_profile:
+        return
+
+    cursor = dbapi_connection.cursor()
+    for name, value in get_db_pragmas(db_profile, DB_PRAGMAS).items():
+        cursor.execute(f"PRAGMA {name}={value}")
+    cursor.close()
+    connection_record.info["db_profile"] = db_profile
+
+
+@contextmanager
+def use_db_profile(profile: str) -> Iterator[None]:
+    """Use the pragmas of `profile` for connections checked out in this context."""
+    global db_profile  # noqa: PLW0603
+    previous, db_profile = db_profile, profile
+    try:
+        yield
+    finally:
+        db_profile = previous
+
+
+query_plan_logger = logging.getLogger("hiking.query_plan")
+
+
+@event.listens_for(engine, "after_cursor_execute")
+def log_query_plan(conn, cursor, statement, parameters, context, executemany):
+    """Log which indexes are used by queries, when debugging."""
+    if (
+        executemany
+        or not statement.startswith("SELECT")
+        or not query_plan_logger.isEnabledFor(logging.DEBUG)
+    ):
+        return
+
+    # Use a plain DBAPI cursor, so this doesn't end up in the query log
+    plan_cursor = cursor.connection.cursor()
+    try:
+        plan = plan_cursor.execute(
+            f"EXPLAIN QUERY PLAN {statement}", parameters
+        ).fetchall()
+    finally:
+        plan_cursor.close()
+    query_plan_logger.debug(
+        "QUERY PLAN\n%s", "\n".join(f"  {detail}" for *_, detail in plan)
+    )
+
+
 Session = sessionmaker(bind=engine)
 session = Session()
+
+
+class Seconds(TypeDecorator):
+    """
+    Store a `datetime.timedelta` as integer seconds.
+
+    Contrary to `Interval`, this allows for aggregating and sorting in SQL.
+    """
+
+    impl = Integer
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        return value // datetime.timedelta(seconds=1)
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        return datetime.timedelta(seconds=value)
+
+
+class PackedTrack(TypeDecorator):
+    """Store a `Track` as packed binary arrays."""
+
+    impl = LargeBinary
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        return value.to_bytes()
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        return Track.from_bytes(value)
+
+
+# Compression algorithms of stored GPX data, selected with `GPX_COMPRESSION`
+GPX_COMPRESSORS = {
+    "zlib": functools.partial(zlib.compress, level=9),
+    "lzma": lzma.compress,
+}
+
+
+def get_gpx_compressor(name: str) -> Callable[[bytes], bytes]:
+    if name not in GPX_COMPRESSORS:
+        msg = f'Unknown GPX compression "{name}"'
+        raise ValueError(msg)
+    return GPX_COMPRESSORS[name]
+
+
+class CompressedText(TypeDecorator):
+    """
+    Store text as a compressed BLOB.
+
+    The compression is configured with `GPX_COMPRESSION`. Values stored as plain
+    text (e.g. from before compression was introduced) are returned unchanged.
+    """
+
+    impl = LargeBinary
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        return get_gpx_compressor(GPX_COMPRESSION)(value.encode())
+
+    def process_result_value(self, value, dialect):
+        if value is None or isinstance(value, str):
+            return value
+        if value.startswith(b"\xfd7zXZ"):
+            return lzma.decompress(value).decode()
+        return zlib.decompress(value).decode()
@@ -1,19 +1,86 @@
+import math
 from typing import TYPE_CHECKING
 
-from hiking.plot import plot
+from hiking.cache import get_plot
+from hiking.plot import COLOR_MODE, PLOT_HEIGHT, get_plot_width, plot
 
 if TYPE_CHECKING:  # pragma: no cover
     from models import Hike
 
+    from hiking.track import Track
+
+
+def downsample(
+    x: list[float], y: list[float], buckets: int
+) -> tuple[list[float], list[float]]:
+    """
+    Reduce the points to the first, lowest, highest and last point per bucket.
+
+    `x` has to be sorted and is split into `buckets` equally wide ranges. With a
+    bucket per column of the canvas, the plotted line looks the same as with all
+    points, peaks and valleys included (M4 aggregation).
+    """
+    if len(x) <= 4 * buckets:
+        return x, y
+
+    start = x[0]
+    width = (x[-1] - start) / buckets or 1
+
+    def get_bucket(value: float) -> int:
+        return min(int((value - start) / width), buckets - 1)
+
+    selected = set()
+    first = low = high = 0
+    current = get_bucket(start)
+    for i in range(1, len(x)):
+        bucket = get_bucket(x[i])
+        if bucket != current:
+            selected.update((first, low, high, i - 1))
+            first = low = high = i
+            current = bucket
+        elif y[i] < y[low]:
+            low = i
+        elif y[i] > y[high]:
+            high = i
+    selected.update((first, low, high, len(x) - 1))
+
+    indexes = sorted(selected)
+    return [x[i] for i in indexes], [y[i] for i in indexes]
+
 
 def get_elevation_profile(hike: "Hike"):
-    if not hike.gpx:
+    track = hike.track
+    if not track:
         return "No *.gpx-file available"
 
+    width = get_plot_width()
+    return get_plot(
+        track,
+        width,
+        PLOT_HEIGHT,
+        COLOR_MODE,
+        render=lambda: render_elevation_profile(track, width),
+    )
+
+
+def render_elevation_profile(track: "Track", width: int):
     x = []
     y = []
-    for point in hike.gpx.get_points_data():
-        x.append(point.distance_from_start / 1000)
-        y.append(round(point.point.elevation))
+    for distance, elevation in zip(track.distance, track.elevation, strict=True):
+        if math.isnan(elevation):
+            continue
+        x.append(distance / 1000)
+        y.append(round(elevation))
+    if not x:
+        return "No elevation data available"
 
-    return plot(x, y, x_limit_min=0, xlabel="Distance (km)", ylabel="elevation (m)")
+    # braille characters have two columns of dots
+    x, y = downsample(x, y, buckets=width * 2)
+    return plot(
+        x,
+        y,
+        x_limit_min=0,
+        xlabel="Distance (km)",
+        ylabel="elevation (m)",
+        width=width,
+    )
@@ -1,14 +1,157 @@
 import datetime
+import functools
+import hashlib
+import io
+import itertools
 import json
+import shutil
+import tempfile
+import textwrap
+import time
+import zipfile
+from collections import deque
+from collections.abc import Callable, Iterable, Iterator
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import nullcontext
 from pathlib import Path
+from typing import Optional, TextIO
 
-import gpxpy
 import sqlalchemy.orm
-from gpxpy.gpx import GPXException
+from sqlalchemy import inspect
+from sqlalchemy.dialects.sqlite import insert
 
+from hiking.cache import get_track
 from hiking.db_utils import session
 from hiking.exceptions import HikingJsonLoaderException
-from hiking.models import Hike
+from hiking.models import GPXData, Hike, ImportCheckpoint, refresh_rollups
+
+JSON_CHUNK_SIZE = 2**16
+IMPORT_BATCH_SIZE = 500
+EXPORT_BATCH_SIZE = 100
+EXPORT_WORKERS = 4
+ARCHIVE_NAME = "hikes.zip"
+ARCHIVE_JSON = "hikes.json"
+
+
+class JsonArrayReader:
+    """
+    Lazily decode the elements of the top-level JSON array in `file`.
+
+    Only the element being decoded is held in memory, so this works for
+    arbitrarily large files. `position` and `digest()` describe the part of the
+    file decoded so far, which is used to resume imports.
+    """
+
+    def __init__(
+        self,
+        file: TextIO,
+        chunk_size: int = JSON_CHUNK_SIZE,
+        archive: Optional[Path] = None,
+    ):
+        self.file = file
+        # archive containing `file` and the GPX files
+        self.archive = archive
+        self.chunk_size = chunk_size
+        self.decoder = json.JSONDecoder()
+        self.buffer = ""
+        self.eof = False
+        self.started = False
+        # number of bytes consumed (UTF-8 encoded, like the file) and their hash
+        self.position = 0
+        self.hash = hashlib.sha256()
+
+    def __iter__(self) -> Iterator:
+        self.start()
+        if self._next_char() == "]":
+            return
+        while True:
+            yield self._decode()
+            if self._consume(",]") == "]":
+                return
+
+    @classmethod
+    def from_archive(cls, archive: Path, **kwargs) -> "JsonArrayReader":
+        """Read the hikes of an archive created by `export --archive`."""
+        with zipfile.ZipFile(archive) as zip_file:
+            # the member stays readable after closing the archive
+            file = io.TextIOWrapper(zip_file.open(ARCHIVE_JSON), encoding="utf-8")
+        return cls(file, archive=archive.absolute(), **kwargs)
+
+    @property
+    def path(self) -> Optional[Path]:
+        """Path of the file (or archive), if it is a regular file."""
+        if self.archive:
+            return self.archive
+        path = Path(getattr(self.file, "name", ""))
+        return path.absolute() if path.is_file() else None
+
+    @property
+    def size(self) -> Optional[int]:
+        if self.archive:
+            with zipfile.ZipFile(self.archive) as zip_file:
+                return zip_file.getinfo(ARCHIVE_JSON).file_size
+        return self.path.stat().st_size if self.path else None
+
+    def start(self):
+        """Consume the opening bracket of the array, fails early for invalid data."""
+        if not self.started:
+            self._consume("[")
+            self.started = True
+
+    def digest(self) -> str:
+        return self.hash.hexdigest()
+
+    def _read_more(self):
+        # grow the read size with the buffer, so large elements aren't decoded
+        # over and over again
+        chunk = self.file.read(max(self.chunk_size, len(self.buffer)))
+        self.eof = not chunk
+        self.buffer += chunk
+
+    def _advance(self, length: int):
+        consumed = self.buffer[:length].encode()
+        self.hash.update(consumed)
+        self.position += len(consumed)
+        self.buffer = self.buffer[length:]
+
+    def _next_char(self) -> str:
+        """Return the next non-whitespace character, or "" at the end of file."""
+        while True:
+            self._advance(len(self.buffer) - len(self.buffer.lstrip()))
+            if self.buffer or self.eof:
+                return self.buffer[:1]
+            self._read_more()
+
+    def _consume(self, allowed: str) -> str:
+        char = self._next_char()
+        if not char:
+            msg = "Unexpected end of JSON data"
+            raise HikingJsonLoaderException(msg)
+        if char not in allowed:
+            expected = " or ".join(f'"{c}"' for c in allowed)
+            msg = f'Expected {expected} in JSON data, found "{char}"'
+            raise HikingJsonLoaderException(msg)
+        self._advance(1)
+        return char
+
+    def _decode(self):
+        self._next_char()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer)
+            except json.JSONDecodeError as e:
+                if self.eof:
+                    position = self.position + len(self.buffer[: e.pos].encode())
+                    msg = f"Cannot decode JSON data: {e.msg} (byte {position})"
+                    raise HikingJsonLoaderException(msg) from e
+                self._read_more()
+                continue
+            if end == len(self.buffer) and not self.eof:
+                # a number could continue in the next chunk
+                self._read_more()
+                continue
+            self._advance(end)
+            return value
 
 
 def validate_json_obj(hike_data: dict):
@@ -36,9 +179,47 @@ def validate_json_obj(hike_data: dict):
         raise HikingJsonLoaderException(msg)
 
 
-def json_importer(json_data: list[dict]):
+@functools.cache
+def open_archive(archive: Path) -> zipfile.ZipFile:
+    # kept open for the whole import, once per worker process
+    return zipfile.ZipFile(archive)
+
+
+def load_gpx_file(path: str, archive: Optional[Path] = None) -> dict:
+    """
+    Read and validate a GPX file, runs in worker processes during imports.
+
+    With `archive`, `path` is the name of the member of the archive.
+    """
+    if archive:
+        try:
+            gpx_xml = open_archive(archive).read(path).decode()
+        except KeyError as e:
+            msg = f'*.gpx file "{path}" not found in archive'
+            raise HikingJsonLoaderException(msg) from e
+    else:
+        gpx_file = Path(path)
+        if not gpx_file.is_file() or not gpx_file.exists():
+            msg = f'*.gpx file "{path}" not found'
+            raise HikingJsonLoaderException(msg)
+        with gpx_file.open("r") as f:
+            gpx_xml = f.read()
+
+    try:
+        track = get_track(gpx_xml)
+    except ValueError as e:
+        raise HikingJsonLoaderException(e.args[0]) from e
+    return {"xml": gpx_xml, "track": track}
+
+
+def import_batch(
+    json_data: list[dict],
+    executor: Optional[Executor] = None,
+    archive: Optional[Path] = None,
+):
     to_add = []
     to_merge = []
+    with_gpx = []
     for raw_hike in json_data:
         validate_json_obj(raw_hike)
 
@@ -54,60 +235,285 @@ def json_importer(json_data: list[dict]):
         except TypeError as e:
             msg = "Wrong duration format"
             raise HikingJsonLoaderException(msg) from e
-        if raw_hike["gpx_file"]:
-            gpx_file = Path(raw_hike["gpx_file"])
-            if not gpx_file.is_file() or not gpx_file.exists():
-                msg = f'*.gpx file "{raw_hike["gpx_file"]}" not found'
-                raise HikingJsonLoaderException(msg)
-            with gpx_file.open("r") as f:
-                gpx_xml = f.read()
-            try:
-                gpxpy.parse(gpx_xml)
-            except GPXException as e:
-                raise HikingJsonLoaderException(e.args[0]) from e
-
-            raw_hike["gpx_xml"] = gpx_xml
-        raw_hike.pop("gpx_file")
+        if gpx_file := raw_hike.pop("gpx_file"):
+            with_gpx.append((raw_hike, gpx_file))
 
         if raw_hike.get("id") is not None:
             to_merge.append(raw_hike)
             continue
         to_add.append(raw_hike)
 
-    session.bulk_insert_mappings(Hike, to_add)
+    # GPX files are parsed in parallel, results (and errors) come back in order
+    map_ = executor.map if executor else map
+    loaded = map_(
+        load_gpx_file,
+        [gpx_file for _, gpx_file in with_gpx],
+        itertools.repeat(archive, len(with_gpx)),
+    )
+    gpx_data = [(raw_hike, data) for (raw_hike, _), data in zip(with_gpx, loaded)]
+
+    # bulk operations don't trigger the update of the rollups on flush
+    rollup_dates = {raw_hike["date"] for raw_hike in [*to_add, *to_merge]}
+    if to_merge:
+        rollup_dates.update(
+            date
+            for (date,) in session.query(Hike.date).filter(
+                Hike.id.in_([raw_hike["id"] for raw_hike in to_merge])
+            )
+        )
+
+    # `return_defaults` sets the IDs needed for the GPX data
+    session.bulk_insert_mappings(Hike, to_add, return_defaults=True)
     session.bulk_update_mappings(Hike, to_merge)
-    session.commit()
+    if rollup_dates:
+        refresh_rollups(session.connection(), rollup_dates)
+    if gpx_data:
+        upsert = insert(GPXData)
+        session.execute(
+            upsert.on_conflict_do_update(
+                index_elements=[GPXData.hike_id],
+                set_={"xml": upsert.excluded.xml, "track": upsert.excluded.track},
+            ),
+            [{"hike_id": raw_hike["id"], **data} for raw_hike, data in gpx_data],
+        )
+
+
+def get_import_checkpoint(
+    reader: JsonArrayReader, hikes: Iterator[dict], resume: bool
+) -> ImportCheckpoint:
+    """
+    Get the checkpoint for importing the file of `reader`.
+
+    With `resume`, the hikes imported before are skipped in `hikes`, provided this
+    part of the file didn't change since.
+    """
+    path = str(reader.path)
+    checkpoint = session.get(ImportCheckpoint, path) or ImportCheckpoint(path=path)
+    if not resume or not checkpoint.imported:
+        checkpoint.imported = 0
+        return checkpoint
+
+    deque(itertools.islice(hikes, checkpoint.imported), maxlen=0)
+    if (reader.position, reader.digest()) != (checkpoint.position, checkpoint.digest):
+        msg = "Cannot resume import, the file changed since"
+        raise HikingJsonLoaderException(msg)
+    return checkpoint
+
+
+def json_importer(
+    json_data: Iterable[dict],
+    batch_size: int = IMPORT_BATCH_SIZE,
+    workers: int = 1,
+    resume: bool = False,
+    on_batch: Optional[Callable[[int], None]] = None,
+) -> int:
+    """
+    Import hikes from `json_data` in batches of `batch_size`.
+
+    `json_data` may be a lazy iterator, only one batch is kept in memory. GPX files
+    are parsed by a pool of `workers` processes. Each batch is committed on its own
+    and, when importing from a file, a checkpoint is recorded with it, so `resume`
+    can skip the hikes imported by a previous, failed import.
+
+    `on_batch` is called with the number of hikes imported so far, once before the
+    first batch and after each batch. Returns the number of imported hikes.
+    """
+    hikes = iter(json_data)
+    checkpoint = archive = None
+    if isinstance(json_data, JsonArrayReader):
+        archive = json_data.archive
+        if json_data.path:
+            checkpoint = get_import_checkpoint(json_data, hikes, resume)
+
+    imported = 0
+    if on_batch:
+        on_batch(imported)
+    with ProcessPoolExecutor(workers) if workers > 1 else nullcontext() as executor:
+        try:
+            while batch := list(itertools.islice(hikes, batch_size)):
+                with session.begin_nested():
+                    import_batch(batch, executor, archive)
+                    if checkpoint:
+                        checkpoint.imported += len(batch)
+                        checkpoint.position = json_data.position
+                        checkpoint.digest = json_data.digest()
+                        session.add(checkpoint)
+                session.commit()
+                imported += len(batch)
+                if on_batch:
+                    on_batch(imported)
+        finally:
+            # the archive may change until the next import
+            open_archive.cache_clear()
+
+    if checkpoint and inspect(checkpoint).persistent:
+        session.delete(checkpoint)
+        session.commit()
+    return imported
+
+
+def write_file_if_changed(path: Path, data: bytes, digest: str) -> bool:
+    """Write `data` to `path`, unless the file has the SHA-256 hash `digest`."""
+    if path.is_file() and path.stat().st_size == len(data):
+        with path.open("rb") as f:
+            if hashlib.file_digest(f, "sha256").hexdigest() == digest:
+                return False
+    # replace instead of overwriting the file, it may be a hardlink
+    temp_path = path.with_name(f".{path.name}.tmp")
+    temp_path.write_bytes(data)
+    temp_path.replace(path)
+    return True
+
+
+def link_file(source: Path, path: Path):
+    if path.exists():
+        if path.samefile(source):
+            return
+        path.unlink()
+    path.hardlink_to(source)
+
+
+class GPXFileWriter:
+    """
+    Write the GPX files of an export with a pool of threads.
+
+    Each distinct GPX file is written once, files with the same content are
+    hardlinks to it. Files which already exist with the same content are kept.
+    """
+
+    def __init__(self, gpx_dir: Path, workers: int = EXPORT_WORKERS):
+        self.gpx_dir = gpx_dir
+        self.executor = ThreadPoolExecutor(workers)
+        # bounds the GPX data waiting to be written
+        self.max_pending = 2 * workers
+        self.pending = deque()
+        # hash of the content -> path and the future writing it
+        self.files = {}
+
+    def __enter__(self) -> "GPXFileWriter":
+        return self
+
+    def __exit__(self, *exc_info):
+        try:
+            for future in self.pending:
+                future.result()
+        finally:
+            self.executor.shutdown(cancel_futures=True)
+
+    def write(self, name: str, xml: str) -> Path:
+        """Write `xml` to the file `name`, returns the path of the written file."""
+        self.gpx_dir.mkdir(exist_ok=True)
+        path = (self.gpx_dir / name).absolute()
+        data = xml.encode()
+        digest = hashlib.sha256(data).hexdigest()
+
+        if digest in self.files:
+            source, future = self.files[digest]
+            future.result()
+            try:
+                link_file(source, path)
+            except OSError:
+                # no hardlinks on this file system, reference the file instead
+                return source
+            return path
+
+        while len(self.pending) >= self.max_pending:
+            self.pending.popleft().result()
+        future = self.executor.submit(write_file_if_changed, path, data, digest)
+        self.pending.append(future)
+        self.files[digest] = (path, future)
+        return path
+
+
+class GPXArchiveWriter:
+    """Write the GPX files of an export to an archive, each distinct file once."""
+
+    def __init__(self, zip_file: zipfile.ZipFile):
+        self.zip_file = zip_file
+        # hash of the content -> name of the member
+        self.files = {}
+
+    def write(self, name: str, xml: str) -> str:
+        """Write `xml` to the member `gpx/<name>`, returns the name of the member."""
+        data = xml.encode()
+        digest = hashlib.sha256(data).hexdigest()
+        if digest not in self.files:
+            self.files[digest] = f"gpx/{name}"
+            self.zip_file.writestr(self.files[digest], data)
+        return self.files[digest]
+
+
+def write_json_array(file: TextIO, items: Iterable):
+    """
+    Write `items` to `file` one by one.
+
+    The output is the same as `json.dump(list(items), file, indent=4)`.
+    """
+    separator = "["
+    for item in items:
+        file.write(f"{separator}\n")
+        file.write(textwrap.indent(json.dumps(item, indent=4), " " * 4))
+        separator = ","
+    file.write("[]" if separator == "[" else "\n]")
 
 
 def json_exporter(
-    query: sqlalchemy.orm.Query, export_dir: Path, include_ids: bool = False
+    query: sqlalchemy.orm.Query,
+    export_dir: Path,
+    include_ids: bool = False,
+    batch_size: int = EXPORT_BATCH_SIZE,
+    archive: bool = False,
 ):
-    data = []
-    gpx_dir = export_dir / "gpx"
-    for hike in query:
-        hike_data = {
-            "name": hike.name,
-            "body": hike.body,
-            "date": str(hike.date),
-            "distance": hike.distance,
-            "elevation_gain": hike.elevation_gain,
-            "elevation_loss": hike.elevation_loss,
-            "duration": round(hike.duration.total_seconds() / 60),
-            "gpx_file": None,
-        }
-        if include_ids:
-            hike_data["id"] = hike.id
-
-        if hike.gpx_xml:
-            gpx_dir.mkdir(exist_ok=True)
-            gpx_file = gpx_dir / f"{hike.id!s}.gpx"
-            with gpx_file.open("w") as f:
-                f.write(hike.gpx_xml)
-            hike_data["gpx_file"] = str(gpx_file.absolute())
-        data.append(hike_data)
-
-    with (export_dir / "hikes.json").open("w") as f:
-        f.write(json.dumps(data, indent=4))
+    """
+    Export the hikes of `query` to `export_dir`.
+
+    Hikes are fetched and written in batches of `batch_size`, a hike (and its GPX
+    data) isn't referenced anymore once it is written. With `archive`, everything
+    is written to a single zip file, each member compressed on its own.
+    """
+
+    def export_hikes() -> Iterator[dict]:
+        for hike in query.order_by(Hike.id).yield_per(batch_size):
+            hike_data = {
+                "name": hike.name,
+                "body": hike.body,
+                "date": str(hike.date),
+                "distance": hike.distance,
+                "elevation_gain": hike.elevation_gain,
+                "elevation_loss": hike.elevation_loss,
+                "duration": round(hike.duration.total_seconds() / 60),
+                "gpx_file": None,
+            }
+            if include_ids:
+                hike_data["id"] = hike.id
+
+            if hike.gpx_xml:
+                gpx_file = gpx_writer.write(f"{hike.id!s}.gpx", hike.gpx_xml)
+                hike_data["gpx_file"] = str(gpx_file)
+            yield hike_data
+
+    if not archive:
+        with (
+            GPXFileWriter(export_dir / "gpx") as gpx_writer,
+            (export_dir / ARCHIVE_JSON).open("w") as f,
+        ):
+            write_json_array(f, export_hikes())
+        return
+
+    with (
+        zipfile.ZipFile(
+            export_dir / ARCHIVE_NAME, "w", compression=zipfile.ZIP_DEFLATED
+        ) as zip_file,
+        # GPX members can't be written while the JSON member is open
+        tempfile.TemporaryFile("w+", encoding="utf-8") as f,
+    ):
+        gpx_writer = GPXArchiveWriter(zip_file)
+        write_json_array(f, export_hikes())
+        f.seek(0)
+        info = zipfile.ZipInfo(ARCHIVE_JSON, time.localtime()[:6])
+        info.compress_type = zipfile.ZIP_DEFLATED
+        with io.TextIOWrapper(zip_file.open(info, "w"), encoding="utf-8") as member:
+            shutil.copyfileobj(f, member)
 
 
 JSON_IMPORT_EXAMPLE = json.dumps(
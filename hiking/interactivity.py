@@ -5,10 +5,9 @@ from shutil import which
 from subprocess import call
 from typing import Optional, Union
 
-import gpxpy
 from rich.prompt import Confirm, FloatPrompt, IntPrompt, Prompt
 
-from hiking.models import Hike
+from hiking.models import Hike, parse_gpx
 from hiking.utils import EDITOR, GPX_VIEWER, console
 
 
@@ -94,8 +93,7 @@ def user_create_edit_interaction(hike: Hike, is_import_from_gpx: bool):
         assert path.exists(), error_msg
         with path.open("r") as f:
             xml_data = f.read()
-        assert gpxpy.parse(xml_data), error_msg
-        return xml_data
+        return parse_gpx(xml_data)
 
     attr_map = {
         "date": {
@@ -1,19 +1,263 @@
+import calendar
 import datetime
+import logging
+import re
 from collections import namedtuple
-from typing import Optional
+from collections.abc import Iterable
+from typing import Optional, Union
 
-import gpxpy
-from sqlalchemy import Column, Date, Float, Integer, Interval, String, Text, or_
-from sqlalchemy.orm import load_only
+from sqlalchemy import (
+    Column,
+    Connection,
+    Date,
+    Float,
+    ForeignKey,
+    Index,
+    Insert,
+    Integer,
+    String,
+    Table,
+    Text,
+    and_,
+    column,
+    event,
+    func,
+    inspect,
+    literal,
+    literal_column,
+    select,
+    table,
+    text,
+    type_coerce,
+)
+from sqlalchemy.ext.associationproxy import association_proxy
+from sqlalchemy.ext.hybrid import hybrid_property
+from sqlalchemy.orm import deferred, load_only, relationship, selectinload, validates
+from sqlalchemy.orm.attributes import flag_modified
 
-from hiking.db_utils import Base, engine, session
+from hiking.db_utils import (
+    Base,
+    CompressedText,
+    PackedTrack,
+    Seconds,
+    Session,
+    engine,
+    session,
+)
+from hiking.track import Track, read_gpx
 from hiking.utils import SlimDateRange, format_value, pretty_timedelta
 
+logger = logging.getLogger(__name__)
+
+# Number of rows updated per transaction when migrations backfill derived data
+MIGRATION_BATCH_SIZE = 1000
+
 
 def create_tables():
+    """
+    Create the tables and migrate the database to `SCHEMA_VERSION`.
+
+    The schema version is stored as `PRAGMA user_version`, so nothing has to be
+    inspected when the database is up to date. Databases created before the
+    schema was versioned have version 0 and run all migrations, which detect by
+    themselves whether there is something to do.
+    """
+    version = get_schema_version()
+    # databases of newer versions are left alone
+    if version >= SCHEMA_VERSION:
+        return
+
+    # only creates missing tables, existing ones are altered by the migrations
     Base.metadata.create_all(engine)
+    for number, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+        migration()
+        set_schema_version(number)
+
+
+def get_schema_version() -> int:
+    with engine.connect() as connection:
+        return connection.exec_driver_sql("PRAGMA user_version").scalar()
+
+
+def set_schema_version(version: int):
+    with engine.begin() as connection:
+        connection.exec_driver_sql(f"PRAGMA user_version = {int(version)}")
+
+
+def backfill_in_batches(statement: str):
+    """
+    Run an `UPDATE` in batches of `MIGRATION_BATCH_SIZE` rows, one per transaction.
+
+    `statement` has to limit the updated rows to `:batch_size` rows still to be
+    updated, so an interrupted backfill continues where it stopped.
+    """
+    batch_size = MIGRATION_BATCH_SIZE
+    while True:
+        with engine.begin() as connection:
+            result = connection.execute(text(statement), {"batch_size": batch_size})
+        if result.rowcount < batch_size:
+            return
+
+
+def migrate_duration_to_seconds():
+    """
+    Migrate `hikes.duration` from `Interval` to `Seconds`.
+
+    Databases created before the migration have no index on `duration`, so this
+    is cheap to detect. SQLite stores intervals as datetimes relative to the epoch.
+    """
+    duration_index = next(
+        index for index in Hike.__table__.indexes if index.name == "ix_hikes_duration"
+    )
+    if duration_index.name in get_index_names():
+        return
+
+    backfill_in_batches(
+        "UPDATE hikes "
+        "SET duration = CAST(strftime('%s', duration) AS INTEGER) "
+        "WHERE id IN ("
+        "SELECT id FROM hikes WHERE typeof(duration) = 'text' LIMIT :batch_size"
+        ")"
+    )
+    duration_index.create(engine)
+
+
+def migrate_gpx_to_side_table():
+    """
+    Move `hikes.gpx_xml` and `hikes.track` to the `gpx_data` table.
+
+    Missing tracks (from databases created before `track` was introduced) are
+    derived from the GPX data.
+    """
+    columns = {column["name"] for column in inspect(engine).get_columns("hikes")}
+    if "gpx_xml" in columns:
+        track = "track" if "track" in columns else "NULL"
+        with engine.begin() as connection:
+            connection.execute(
+                text(
+                    "INSERT INTO gpx_data (hike_id, xml, track) "  # noqa: S608
+                    f"SELECT id, gpx_xml, {track} FROM hikes "
+                    "WHERE gpx_xml IS NOT NULL"
+                )
+            )
+            connection.execute(text("ALTER TABLE hikes DROP COLUMN gpx_xml"))
+            if "track" in columns:
+                connection.execute(text("ALTER TABLE hikes DROP COLUMN track"))
+
+    # GPX data accepted by gpxpy but not by `read_gpx` is kept without track
+    unreadable = []
+    missing_tracks = session.query(GPXData).filter(GPXData.track.is_(None))
+    while batch := (
+        missing_tracks.filter(GPXData.hike_id.not_in(unreadable))
+        .limit(MIGRATION_BATCH_SIZE)
+        .all()
+    ):
+        for gpx_data in batch:
+            try:
+                gpx_data.track = read_gpx(gpx_data.xml).track
+            except ValueError as e:
+                logger.warning(
+                    "Cannot read the GPX data of hike %s: %s", gpx_data.hike_id, e
+                )
+                unreadable.append(gpx_data.hike_id)
+        session.commit()
+
+
+def get_index_names() -> set[str]:
+    # The SQLAlchemy inspector doesn't reflect expression-based indexes
+    with engine.connect() as connection:
+        indexes = connection.exec_driver_sql('PRAGMA main.index_list("hikes")')
+        return {name for _, name, *_ in indexes}
 
 
+def create_missing_indexes():
+    """Create indexes added to existing tables after their creation."""
+    existing = get_index_names()
+    for index in Hike.__table__.indexes:
+        if index.name not in existing:
+            index.create(engine)
+
+
+# Full-text index on `hikes.name` and `hikes.body`, kept in sync by triggers
+HIKES_FTS = table(
+    "hikes_fts",
+    column("rowid", Integer),
+    column("hikes_fts"),
+    column("rank", Float),
+)
+
+SEARCH_INDEX_DDL = [
+    "CREATE VIRTUAL TABLE hikes_fts USING fts5("
+    "name, body, content='hikes', content_rowid='id', "
+    "tokenize='unicode61 remove_diacritics 2', prefix='2 3')",
+    # Matches in `name` are ranked higher
+    "INSERT INTO hikes_fts(hikes_fts, rank) VALUES('rank', 'bm25(10.0, 1.0)')",
+    "CREATE TRIGGER hikes_fts_insert AFTER INSERT ON hikes BEGIN "
+    "INSERT INTO hikes_fts(rowid, name, body) VALUES (new.id, new.name, new.body); "
+    "END",
+    "CREATE TRIGGER hikes_fts_delete AFTER DELETE ON hikes BEGIN "
+    "INSERT INTO hikes_fts(hikes_fts, rowid, name, body) "
+    "VALUES ('delete', old.id, old.name, old.body); "
+    "END",
+    "CREATE TRIGGER hikes_fts_update AFTER UPDATE OF name, body ON hikes BEGIN "
+    "INSERT INTO hikes_fts(hikes_fts, rowid, name, body) "
+    "VALUES ('delete', old.id, old.name, old.body); "
+    "INSERT INTO hikes_fts(rowid, name, body) VALUES (new.id, new.name, new.body); "
+    "END",
+    # Index already existing hikes
+    "INSERT INTO hikes_fts(hikes_fts) VALUES('rebuild')",
+]
+
+
+# A `"..."` phrase or a word
+SEARCH_TERM = re.compile(r'"([^"]*)"|([^\s"]+)')
+
+
+def get_search_query(search: str) -> str:
+    """
+    FTS5 query matching hikes containing all terms of `search`.
+
+    Terms are quoted, so punctuation and FTS5 keywords are matched as text. Words
+    match as prefixes of words, a trailing `*` is optional, and phrases as words
+    in this order.
+    """
+    terms = []
+    for phrase, word in SEARCH_TERM.findall(search):
+        if phrase.strip():
+            terms.append(f'"{phrase}"')
+        elif word := word.rstrip("*"):
+            terms.append(f'"{word}"*')
+    return " ".join(terms)
+
+
+def create_search_index():
+    if inspect(engine).has_table("hikes_fts"):
+        return
+
+    with engine.begin() as connection:
+        for statement in SEARCH_INDEX_DDL:
+            connection.execute(text(statement))
+
+
+def create_rollups():
+    # fills `HIKE_ROLLUPS`, created as a new table by `create_all`
+    rebuild_rollups()
+
+
+# Ordered migrations, the schema version of a database is the number of
+# migrations applied to it. New migrations are appended, never reordered.
+MIGRATIONS = [
+    migrate_duration_to_seconds,
+    migrate_gpx_to_side_table,
+    create_missing_indexes,
+    create_search_index,
+    create_rollups,
+]
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
+# Calculated fields are implemented as `hybrid_property` on the model, providing
+# a SQL expression so they can be used for ordering, filtering and aggregating.
 CalculatedField = namedtuple(  # noqa: PYI024
     "CalculatedField", ["info"]
 )
@@ -35,6 +279,50 @@ def info_dict(
     }
 
 
+# GPX data with the metadata and track read from it, passed around so it's read
+# only once
+ParsedGPX = namedtuple(  # noqa: PYI024
+    "ParsedGPX", ["xml", "name", "time", "track"]
+)
+
+
+def parse_gpx(xml: str) -> ParsedGPX:
+    return ParsedGPX(xml, *read_gpx(xml))
+
+
+class GPXData(Base):
+    """GPX data of a hike, kept separate to keep the `hikes` table small."""
+
+    __tablename__ = "gpx_data"
+
+    hike_id = Column(
+        Integer, ForeignKey("hikes.id", ondelete="CASCADE"), primary_key=True
+    )
+    xml = deferred(Column(CompressedText, nullable=False))
+    # Points of the GPX track, derived when `xml` is set
+    track = deferred(Column(PackedTrack))
+
+    @validates("xml")
+    def validate_xml(self, key: str, xml: Union[str, ParsedGPX, None]):
+        if isinstance(xml, str):
+            xml = parse_gpx(xml)
+        self.track = xml.track if xml else None
+        return xml.xml if xml else None
+
+
+class ImportCheckpoint(Base):
+    """Progress of an import from a file, so it can be resumed after a failure."""
+
+    __tablename__ = "import_checkpoints"
+
+    path = Column(String, primary_key=True)
+    # Number of imported hikes, and length and SHA-256 hash of the part of the
+    # file containing them
+    imported = Column(Integer, nullable=False, default=0)
+    position = Column(Integer, nullable=False, default=0)
+    digest = Column(String, nullable=False, default="")
+
+
 class Hike(Base):
     __tablename__ = "hikes"
 
@@ -46,11 +334,13 @@ class Hike(Base):
     date = Column(
         Date,
         nullable=False,
+        index=True,
         info=info_dict(name="date", pretty_name="Date"),
     )
     name = Column(
         String,
         nullable=False,
+        index=True,
         info=info_dict(name="name", pretty_name="Name"),
     )
     body = Column(
@@ -61,6 +351,7 @@ class Hike(Base):
     distance = Column(
         Float,
         nullable=False,
+        index=True,
         info=info_dict(
             name="distance",
             pretty_name="➡ km",
@@ -70,6 +361,7 @@ class Hike(Base):
     elevation_gain = Column(
         Integer,
         nullable=False,
+        index=True,
         info=info_dict(
             name="elevation_gain",
             pretty_name="⬈ m",
@@ -79,6 +371,7 @@ class Hike(Base):
     elevation_loss = Column(
         Integer,
         nullable=False,
+        index=True,
         info=info_dict(
             name="elevation_loss",
             pretty_name="⬊ m",
@@ -86,18 +379,26 @@ class Hike(Base):
         ),
     )
     duration = Column(
-        Interval,
+        Seconds,
         nullable=False,
+        index=True,
         info=info_dict(
             name="duration",
             pretty_name="⏱ ",
             supported_calculations=["sum", "avg", "min", "max"],
         ),
     )
-    gpx_xml = Column(
-        Text,
+    gpx_data = relationship(
+        GPXData, uselist=False, cascade="all, delete-orphan", passive_deletes=True
+    )
+    # Only loaded (and decompressed) when accessed
+    gpx_xml = association_proxy(
+        "gpx_data",
+        "xml",
+        creator=lambda xml: GPXData(xml=xml),
+        cascade_scalar_deletes=True,
         info=info_dict(
-            name="gpx",
+            name="gpx_xml",
             pretty_name="GPX",
             data_view=False,
         ),
@@ -123,24 +424,34 @@ class Hike(Base):
         ),
     ]
 
-    _gpx = None
-
-    @property
-    def speed(self):
+    @hybrid_property
+    def speed(self) -> Optional[float]:
+        # `None` without duration, like the division by zero in SQL
+        if not self.duration.seconds:
+            return None
         return self.distance * 60 / (self.duration.seconds / 60)
 
+    @speed.inplace.expression
+    @classmethod
+    def _speed_expression(cls):
+        # Mirror `timedelta.seconds`, which doesn't take days into account.
+        # Literals are rendered inline, so `ix_hikes_speed` can be used.
+        return (
+            cls.distance
+            * literal_column("3600")
+            / (type_coerce(cls.duration, Integer) % literal_column("86400"))
+        )
+
     @property
-    def gpx(self):
-        if self.gpx_xml and not self._gpx:
-            self._gpx = gpxpy.parse(self.gpx_xml)
-        return self._gpx
+    def track(self) -> Optional[Track]:
+        return self.gpx_data.track if self.gpx_data else None
 
     def get_pretty_value(
         self,
         attr: str,
     ):
         value = getattr(self, attr)
-        return format_value(value, attr)
+        return "-" if value is None else format_value(value, attr)
 
     def get_stats(self) -> list[str]:
         serialized = []
@@ -161,23 +472,26 @@ class Hike(Base):
             value = getattr(self, field.info["name"])
             if isinstance(value, datetime.timedelta):
                 value = pretty_timedelta(value)
-            elif field.info["name"] == "speed":
+            elif field.info["name"] == "speed" and value is not None:
                 value = round(value, 2)
             serialized[field.info["pretty_name"]] = value
 
         return serialized
 
-    def load_gpx(self, gpx: str):
-        gpx_obj = gpxpy.parse(gpx)
+    def load_gpx(self, gpx: Union[str, ParsedGPX]):
+        if isinstance(gpx, str):
+            gpx = parse_gpx(gpx)
+        self.gpx_xml = gpx
+        uphill, downhill = self.track.get_uphill_downhill()
+        duration = self.track.get_duration()
 
         data = {
-            "date": gpx_obj.time.date() if gpx_obj.time else None,
-            "name": gpx_obj.name,
-            "distance": round(gpx_obj.length_3d() / 1000, 2),
-            "elevation_gain": round(gpx_obj.get_uphill_downhill().uphill),
-            "elevation_loss": round(gpx_obj.get_uphill_downhill().downhill),
-            "duration": gpx_obj.get_duration(),
-            "gpx_xml": gpx,
+            "date": gpx.time.date() if gpx.time else None,
+            "name": gpx.name,
+            "distance": round(self.track.length_3d() / 1000, 2),
+            "elevation_gain": round(uphill),
+            "elevation_loss": round(downhill),
+            "duration": datetime.timedelta(seconds=duration) if duration else None,
         }
         for attr, value in data.items():
             if value:
@@ -199,6 +513,161 @@ class Hike(Base):
         return self.__str__()
 
 
+# Index used for ordering by the calculated `speed`
+Index("ix_hikes_speed", Hike.speed)
+
+
+# Periods of the rollups and the `strftime` format of their buckets
+ROLLUP_PERIODS = {
+    "day": "%Y-%m-%d",
+    "month": "%Y-%m",
+    "year": "%Y",
+}
+
+# Aggregates stored per rollup, by prefix of the column. Rollups are combined with
+# the second function, averages are derived from the sum and the count.
+ROLLUP_FUNCTIONS = {
+    "count": (func.count, func.sum),
+    "sum": (func.sum, func.sum),
+    "min": (func.min, func.min),
+    "max": (func.max, func.max),
+}
+
+
+def get_rollup_keys() -> list[tuple[str, str]]:
+    """`(prefix, attr)` of the aggregates stored per rollup, starting with the count."""
+    keys = [("count", "id")]
+    for field in Hike.FIELDS:
+        calculations = field.info["supported_calculations"]
+        needed = {
+            "sum": "sum" in calculations or "avg" in calculations,
+            "count": "avg" in calculations,
+            "min": "min" in calculations,
+            "max": "max" in calculations,
+        }
+        keys += [(prefix, field.info["name"]) for prefix in needed if needed[prefix]]
+    return keys
+
+
+# Totals of the hikes per day, month and year, so stats over periods don't have to
+# read every hike. Kept up to date on every change of hikes, see `refresh_rollups`.
+HIKE_ROLLUPS = Table(
+    "hike_rollups",
+    Base.metadata,
+    Column("period", String, primary_key=True),
+    Column("bucket", String, primary_key=True),
+    *(
+        Column(
+            f"{prefix}_{attr}",
+            Integer if prefix == "count" else getattr(Hike, attr).type,
+        )
+        for prefix, attr in get_rollup_keys()
+    ),
+)
+
+# Attributes of hikes the rollups are derived from
+ROLLUP_ATTRS = [
+    "date",
+    *(
+        field.info["name"]
+        for field in Hike.FIELDS
+        if field.info["supported_calculations"] and not field.info["calculated_value"]
+    ),
+]
+
+
+def get_period_bounds(period: str, date: datetime.date) -> tuple:
+    """First and last day of the `period` containing `date`."""
+    if period == "month":
+        last_day = calendar.monthrange(date.year, date.month)[1]
+        return date.replace(day=1), date.replace(day=last_day)
+    if period == "year":
+        return date.replace(month=1, day=1), date.replace(month=12, day=31)
+    return date, date
+
+
+def insert_rollups(period: str, condition=None) -> Insert:
+    """Statement inserting the rollups of `period` of the hikes matching `condition`."""
+    bucket = func.strftime(ROLLUP_PERIODS[period], Hike.date)
+    rollups = select(
+        literal(period),
+        bucket,
+        *(
+            ROLLUP_FUNCTIONS[prefix][0](getattr(Hike, attr))
+            for prefix, attr in get_rollup_keys()
+        ),
+    ).group_by(bucket)
+    if condition is not None:
+        rollups = rollups.where(condition)
+    return HIKE_ROLLUPS.insert().from_select(list(HIKE_ROLLUPS.c.keys()), rollups)
+
+
+def refresh_rollups(connection: Connection, dates: Iterable[datetime.date]):
+    """Recompute the rollups of the periods containing `dates` from their hikes."""
+    dates = set(dates)
+    for period, date_format in ROLLUP_PERIODS.items():
+        buckets = {date.strftime(date_format) for date in dates}
+        connection.execute(
+            HIKE_ROLLUPS.delete().where(
+                HIKE_ROLLUPS.c.period == period, HIKE_ROLLUPS.c.bucket.in_(buckets)
+            )
+        )
+        # the range of dates lets SQLite use `ix_hikes_date`
+        first_day = get_period_bounds(period, min(dates))[0]
+        last_day = get_period_bounds(period, max(dates))[1]
+        connection.execute(
+            insert_rollups(
+                period,
+                and_(
+                    Hike.date.between(first_day, last_day),
+                    func.strftime(date_format, Hike.date).in_(buckets),
+                ),
+            )
+        )
+
+
+def rebuild_rollups() -> dict[str, int]:
+    """Recompute all rollups, returns the number of rollups per period."""
+    session.execute(HIKE_ROLLUPS.delete())
+    for period in ROLLUP_PERIODS:
+        session.execute(insert_rollups(period))
+    session.commit()
+    return dict(
+        session.query(HIKE_ROLLUPS.c.period, func.count()).group_by(
+            HIKE_ROLLUPS.c.period
+        )
+    )
+
+
+@event.listens_for(Session, "before_flush")
+def collect_rollup_dates(flushed_session, flush_context, instances):
+    """Remember the dates of the hikes whose rollups change with the flush."""
+    dates = flushed_session.info.setdefault("rollup_dates", set())
+    for hike in [*flushed_session.new, *flushed_session.deleted]:
+        if isinstance(hike, Hike):
+            dates.add(hike.date)
+    for hike in flushed_session.dirty:
+        if not isinstance(hike, Hike) or hike in flushed_session.deleted:
+            continue
+        state = inspect(hike)
+        histories = [state.attrs[attr].history for attr in ROLLUP_ATTRS]
+        if any(history.has_changes() for history in histories):
+            # a changed date moves the hike out of the rollups of its former date
+            dates.update([hike.date, *histories[0].deleted])
+
+
+@event.listens_for(Hike.date, "set", active_history=True)
+def load_previous_date(_hike, value, _previous, _initiator):
+    """Load the stored date before it changes, its rollups need updating too."""
+    return value
+
+
+@event.listens_for(Session, "after_flush")
+def update_rollups(flushed_session, flush_context):
+    if dates := flushed_session.info.pop("rollup_dates", None):
+        refresh_rollups(flushed_session.connection(), dates)
+
+
 def get_filtered_query(
     ids: Optional[list[int]] = None,
     daterange: Optional["SlimDateRange"] = None,
@@ -211,17 +680,16 @@ def get_filtered_query(
             Hike.date <= daterange.upper
         )
     if search:
-        query = query.filter(
-            or_(
-                Hike.name.icontains(search, autoescape=True),
-                Hike.body.icontains(search, autoescape=True),
-            )
+        query = query.join(HIKES_FTS, HIKES_FTS.c.rowid == Hike.id).filter(
+            HIKES_FTS.c.hikes_fts.match(get_search_query(search))
         )
     if ids:
         query = query.filter(Hike.id.in_(ids))
 
     # Only fetch columns needed for tabular stats
-    if not load_all_columns:
+    if load_all_columns:
+        query = query.options(selectinload(Hike.gpx_data).undefer(GPXData.xml))
+    else:
         query = query.options(
             load_only(
                 Hike.id,
@@ -235,3 +703,27 @@ def get_filtered_query(
         )
 
     return query
+
+
+def compress_gpx_data(batch_size: int = 100) -> int:
+    """
+    Rewrite the stored GPX data of all hikes, compressing it with `GPX_COMPRESSION`.
+
+    Returns the number of rewritten hikes.
+    """
+    ids = [pk for (pk,) in session.query(GPXData.hike_id)]
+    for offset in range(0, len(ids), batch_size):
+        gpx_data_list = (
+            session.query(GPXData)
+            .filter(GPXData.hike_id.in_(ids[offset : offset + batch_size]))
+            .options(load_only(GPXData.hike_id, GPXData.xml))
+        )
+        for gpx_data in gpx_data_list:
+            flag_modified(gpx_data, "xml")
+        session.commit()
+
+    # Give the space of the uncompressed data back to the file system
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.exec_driver_sql("VACUUM")
+
+    return len(ids)
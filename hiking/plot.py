@@ -3,17 +3,25 @@ import shutil
 from decimal import Decimal
 from typing import Optional, Union
 
-import plotille
-
 from hiking.utils import format_value, pretty_timedelta
 
+PLOT_HEIGHT = 20
+COLOR_MODE = "rgb"
+
+
+def get_plot_width() -> int:
+    # plotille only allows for setting the plot width, but will add 33 more chars
+    # to its output
+    return max(shutil.get_terminal_size((47, 20)).columns - 33, 47)
+
 
 def plot(
     x: list[Union[datetime.date, Decimal, int, datetime.timedelta, float]],
     y: list[Union[datetime.date, Decimal, int, datetime.timedelta, float]],
     xlabel: Optional[str],
     ylabel: Optional[str],
-    height: int = 20,
+    height: int = PLOT_HEIGHT,
+    width: Optional[int] = None,
     x_limit_min: Optional[
         Union[datetime.date, Decimal, int, datetime.timedelta, float]
     ] = None,
@@ -27,6 +35,8 @@ def plot(
         Union[datetime.date, Decimal, int, datetime.timedelta, float]
     ] = None,
 ):
+    import plotille
+
     x_type = type(x[0])
     y_type = type(y[0])
 
@@ -48,16 +58,12 @@ def plot(
     def set_xticks(tick, arg2):
         return handle_ticks(tick, x_type)
 
-    # plotille only allows for setting the plot width, but will add 33 more chars
-    # to its output
-    plot_width = max(shutil.get_terminal_size((47, 20)).columns - 33, 47)
-
     fig = plotille.Figure()
     fig.y_ticks_fkt = set_yticks
     fig.x_ticks_fkt = set_xticks
     fig.set_x_limits(min_=x_limit_min, max_=x_limit_max)
     fig.set_y_limits(min_=y_limit_min, max_=y_limit_max)
-    fig.width = plot_width
+    fig.width = width or get_plot_width()
     fig.height = height
     fig.x_label = xlabel
     fig.y_label = ylabel
@@ -73,7 +79,7 @@ def plot(
     x = [conversion_map[type(i)](i) for i in x]
     y = [conversion_map[type(i)](i) for i in y]
 
-    fig.color_mode = "rgb"
+    fig.color_mode = COLOR_MODE
     fig.plot(x, y, lc=[82, 47, 112], label="square")
     fig.scatter(x, y, lc=[6, 150, 45], label="scatter")
     return fig.show()
@@ -0,0 +1,34 @@
+from rich.progress import (
+    BarColumn,
+    DownloadColumn,
+    Progress,
+    ProgressColumn,
+    Task,
+    TextColumn,
+    TimeElapsedColumn,
+    TransferSpeedColumn,
+)
+from rich.text import Text
+
+from hiking.utils import console
+
+
+class HikesSpeedColumn(ProgressColumn):
+    """Number of imported hikes and hikes per second."""
+
+    def render(self, task: Task) -> Text:
+        hikes = task.fields["hikes"]
+        speed = hikes / task.elapsed if task.elapsed else 0
+        return Text(f"{hikes} hikes {speed:.0f}/s", style="progress.data.speed")
+
+
+def import_progress() -> Progress:
+    return Progress(
+        TextColumn("Importing"),
+        BarColumn(),
+        DownloadColumn(),
+        TransferSpeedColumn(),
+        HikesSpeedColumn(),
+        TimeElapsedColumn(),
+        console=console,
+    )
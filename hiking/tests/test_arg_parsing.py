@@ -1,4 +1,7 @@
 import datetime
+import hashlib
+import io
+import json
 from pathlib import Path
 from uuid import uuid4
 
@@ -7,6 +10,8 @@ from rich import box
 
 from hiking import arg_parsing
 from hiking.arg_parsing import parse_arguments
+from hiking.exceptions import HikingJsonLoaderException
+from hiking.import_export import JsonArrayReader
 from hiking.utils import SlimDateRange
 
 
@@ -63,7 +68,8 @@ def test_gpx_file_type(gpx_file, gpx_xml, json_file, success):
         return
 
     args = parse_arguments(["create", "--gpx", str(gpx_file.absolute())])
-    assert args.gpx == gpx_xml
+    assert args.gpx.xml == gpx_xml
+    assert args.gpx.name == "My awesome hike"
 
 
 @pytest.mark.parametrize("success", [True, False])
@@ -74,7 +80,67 @@ def test_json_file_type(gpx_file, json_file, json_import_data, success):
         return
 
     args = parse_arguments(["import", str(json_file.absolute())])
-    assert args.json_data == json_import_data
+    assert list(args.json_data) == json_import_data
+
+
+@pytest.mark.parametrize(
+    "value, success", [("1", True), ("8", True), ("0", False), ("foo", False)]
+)
+def test_validate_workers(json_file, value, success):
+    assert parse_arguments(["import", str(json_file.absolute())]).workers == 1
+
+    args = ["import", str(json_file.absolute()), "--workers", value]
+    if not success:
+        with pytest.raises(SystemExit):
+            parse_arguments(args)
+        return
+
+    assert parse_arguments(args).workers == int(value)
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 2**16])
+def test_json_array_reader(json_import_data, chunk_size):
+    data = [*json_import_data, {"body": "ü" * 100}, 12345, "string", [], None]
+    for dump in [json.dumps(data), json.dumps(data, indent=4)]:
+        reader = JsonArrayReader(io.StringIO(dump), chunk_size=chunk_size)
+        assert list(reader) == data
+
+    assert list(JsonArrayReader(io.StringIO(" [ ] "), chunk_size=chunk_size)) == []
+
+
+def test_json_array_reader_position(tmp_path, json_import_data):
+    path = tmp_path / "hikes.json"
+    path.write_text(
+        json.dumps(
+            [{**hike, "name": "Zürichsee ⛰"} for hike in json_import_data],
+            ensure_ascii=False,
+        ),
+        encoding="utf-8",
+    )
+
+    with path.open(encoding="utf-8") as file:
+        reader = JsonArrayReader(file, chunk_size=7)
+        hikes = list(reader)
+    assert hikes[0]["name"] == "Zürichsee ⛰"
+    assert reader.position == reader.size == path.stat().st_size
+    assert reader.digest() == hashlib.sha256(path.read_bytes()).hexdigest()
+
+
+@pytest.mark.parametrize(
+    "data, message",
+    [
+        ("", "Unexpected end of JSON data"),
+        ('{"foo": "bar"}', 'Expected "[" in JSON data, found "{"'),
+        ('[{"foo": "bar"}', "Unexpected end of JSON data"),
+        ('[{"foo": "bar"} {}]', 'Expected "," or "]" in JSON data, found "{"'),
+        ('[{"foo": "bar"},]', "Cannot decode JSON data: Expecting value"),
+        ('[{"foo": }]', "Cannot decode JSON data: Expecting value"),
+    ],
+)
+def test_json_array_reader_failure(data, message):
+    with pytest.raises(HikingJsonLoaderException) as e:
+        list(JsonArrayReader(io.StringIO(data), chunk_size=4))
+    assert e.value.args[0].startswith(message)
 
 
 @pytest.mark.parametrize(
@@ -104,6 +170,61 @@ def test_validate_order_key(value, success, reverse):
     assert args.order_key == (value, reverse)
 
 
+@pytest.mark.parametrize(
+    "value, success",
+    [
+        ("paul", True),
+        ("pau*", True),
+        ('"hike to"', True),
+        ("hike OR walk", True),
+        ('"unbalanced', True),
+        ("OR", True),
+        ("adrenaline's", True),
+        ("", False),
+        ("*", False),
+        ('""', False),
+    ],
+)
+def test_validate_search(value, success):
+    if not success:
+        with pytest.raises(SystemExit):
+            parse_arguments(["show", "--search", value])
+        return
+
+    args = parse_arguments(["show", "--search", value])
+    assert args.search == value
+
+
+@pytest.mark.parametrize("search", [None, "paul"])
+def test_order_key_rank(search):
+    args = ["show", "--order-key=rank"]
+    if not search:
+        with pytest.raises(SystemExit):
+            parse_arguments(args)
+        return
+
+    args = parse_arguments([*args, "--search", search])
+    assert args.order_key == ("rank", False)
+
+
+@pytest.mark.parametrize(
+    "args, success",
+    [
+        (["--group-by", "month"], True),
+        (["--group-by", "week", "--order-key=-date"], True),
+        (["--group-by", "day"], False),
+        (["--group-by", "year", "--order-key=distance"], False),
+    ],
+)
+def test_group_by(args, success):
+    if not success:
+        with pytest.raises(SystemExit):
+            parse_arguments(["show", *args])
+        return
+
+    assert parse_arguments(["show", *args]).group_by == args[1]
+
+
 @pytest.mark.parametrize(
     "value1, value2, success",
     [
@@ -151,6 +272,23 @@ def test_set_default_subparser():
     assert args.table_style == box.SIMPLE
 
 
+@pytest.mark.parametrize(
+    "args, expected",
+    [
+        (["edit", "1"], {"command": "edit", "id": 1, "gpx": None, "debug": False}),
+        (["compress", "--debug"], {"command": "compress", "debug": True}),
+        (["rebuild"], {"command": "rebuild", "debug": False}),
+        (
+            ["cache", "clear"],
+            {"command": "cache", "action": "clear", "debug": False},
+        ),
+    ],
+)
+def test_subcommand_arguments(args, expected):
+    # only the arguments of the invoked subcommand are added
+    assert vars(parse_arguments(args)) == expected
+
+
 def test_delete_ids_and_all():
     with pytest.raises(SystemExit):
         parse_arguments(["delete", "--all", "1", "2", "3"])
@@ -158,6 +296,22 @@ def test_delete_ids_and_all():
         parse_arguments(["delete"])
 
 
+@pytest.mark.parametrize(
+    "attr, value",
+    [
+        ("DB_PROFILE", "fast"),
+        ("DB_PRAGMAS", "cache_size=1;"),
+        ("CACHE_SIZE", "1.5"),
+        ("GPX_COMPRESSION", "xz"),
+    ],
+)
+def test_invalid_settings(monkeypatch, attr, value):
+    monkeypatch.setattr(arg_parsing, attr, value)
+
+    with pytest.raises(SystemExit):
+        parse_arguments([])
+
+
 def test_data_home_not_writable(monkeypatch):
     monkeypatch.setattr(arg_parsing, "DATA_HOME", Path(f"/{uuid4()}"))
 
@@ -1,6 +1,10 @@
+import datetime
+
 import pytest
 
-from hiking.models import Hike
+from hiking.collection import HikeCollection
+from hiking.models import Hike, get_filtered_query
+from hiking.utils import SlimDateRange, format_value
 
 
 @pytest.mark.parametrize("field", [f.info for f in Hike.FIELDS])
@@ -19,6 +23,102 @@ def test_collection_attr_functions(collection, snapshot, field):
             )
 
 
+def test_collection_min_max_without_speed(hike_factory):
+    hikes = hike_factory.create_batch(2)
+    # no speed without the seconds part of the duration
+    hike_factory(duration=datetime.timedelta(days=1))
+    collection = HikeCollection(get_filtered_query())
+
+    _, results = collection.aggregate()
+    assert collection.min("speed") == min(hike.speed for hike in hikes)
+    assert collection.max("speed") == max(hike.speed for hike in hikes)
+    assert results["min", "speed"] == pytest.approx(collection.min("speed"))
+    assert results["max", "speed"] == pytest.approx(collection.max("speed"))
+
+    empty = HikeCollection(get_filtered_query(ids=[hikes[0].id + 100]))
+    assert empty.min("speed") is None
+
+
+@pytest.mark.parametrize(
+    "period, reverse, expected",
+    [
+        ("week", False, [("2023-W01", 2), ("2023-W05", 1), ("2024-W09", 1)]),
+        ("month", False, [("2023-01", 2), ("2023-02", 1), ("2024-03", 1)]),
+        ("year", False, [("2023", 3), ("2024", 1)]),
+        ("year", True, [("2024", 1), ("2023", 3)]),
+    ],
+)
+def test_collection_aggregate_by_period(
+    hike_factory, caplog, debug_logging, period, reverse, expected
+):
+    # Monday and Sunday of the first week of 2023
+    dates = ["2023-01-02", "2023-01-08", "2023-02-01", "2024-03-01"]
+    for date in dates:
+        hike_factory(date=datetime.date.fromisoformat(date))
+    caplog.clear()
+
+    periods = HikeCollection(get_filtered_query()).aggregate_by_period(period, reverse)
+    assert sum(msg.startswith("SELECT") for msg in caplog.messages) == 1
+
+    assert [(label, count) for label, count, _ in periods] == expected
+    label, _, results = periods[-1 if reverse else 0]
+    # matches the aggregation of the hikes of the period alone
+    _, expected_results = HikeCollection(
+        get_filtered_query(
+            daterange=SlimDateRange(
+                datetime.date.fromisoformat(dates[0]),
+                datetime.date.fromisoformat(dates[1 if period != "year" else 2]),
+            )
+        )
+    ).aggregate()
+    assert label.startswith("2023")
+    assert results == expected_results
+
+
+@pytest.mark.parametrize(
+    "daterange",
+    [
+        SlimDateRange(datetime.date.min, datetime.date.max),
+        SlimDateRange(datetime.date(2000, 1, 1), datetime.date(2024, 12, 31)),
+        SlimDateRange(datetime.date(1900, 1, 1), datetime.date(1900, 12, 31)),
+    ],
+)
+@pytest.mark.parametrize("period", ["week", "month", "year"])
+def test_collection_rollups(collection, caplog, debug_logging, daterange, period):
+    query = get_filtered_query(daterange=daterange)
+    from_hikes = HikeCollection(query)
+    from_rollups = HikeCollection(query, daterange=daterange)
+
+    def get_formatted(results: dict) -> dict:
+        # averages of no hikes are `None`
+        return {
+            key: value if value is None else format_value(value, key[1])
+            for key, value in results.items()
+        }
+
+    count, results = from_rollups.aggregate()
+    assert any("FROM hike_rollups" in message for message in caplog.messages)
+    assert (count, get_formatted(results)) == (
+        from_hikes.aggregate()[0],
+        get_formatted(from_hikes.aggregate()[1]),
+    )
+
+    assert [
+        (label, count, get_formatted(results))
+        for label, count, results in from_rollups.aggregate_by_period(period)
+    ] == [
+        (label, count, get_formatted(results))
+        for label, count, results in from_hikes.aggregate_by_period(period)
+    ]
+
+
+def test_collection_period_stats(collection, snapshot):
+    stats, footer = collection.get_collection_stats(("date", False), group_by="month")
+
+    assert stats == snapshot(name="stats")
+    assert footer == collection.get_totals()
+
+
 @pytest.mark.parametrize(
     "order_params",
     [
@@ -35,18 +135,41 @@ def test_collection_hikes_stats(
     prefix = "-" if order_params[1] else ""
     assert stats == snapshot(name=f'order_param: "{prefix}{order_params[0]} - stats"')
 
-    assert len(caplog.messages) == 3
+    assert len(caplog.messages) == 4
     assert caplog.messages[0] == "BEGIN (implicit)"
     assert caplog.messages[2].startswith("[generated in 0.00")
     assert caplog.messages[1] == snapshot(
         name=f'order_param: "{prefix}{order_params[0]}" - query'
     )
+    assert caplog.messages[3] == snapshot(
+        name=f'order_param: "{prefix}{order_params[0]}" - query plan'
+    )
+
+
+@pytest.mark.parametrize("reverse", [False, True])
+def test_collection_hikes_stats_rank(hike_factory, reverse):
+    hike_factory(name="Mountain", body="Lake")
+    hike_factory(name="Lake", body="Mountain")
+
+    collection = HikeCollection(get_filtered_query(search="lake"))
+    names = [stats[2] for stats in collection.get_hikes_stats(("rank", reverse))]
+    # matches in name are ranked higher
+    assert names == (["Mountain", "Lake"] if reverse else ["Lake", "Mountain"])
 
 
 def test_collection_get_totals(collection, snapshot):
     assert collection.get_totals() == snapshot
 
 
+def test_collection_aggregate(collection, caplog, debug_logging):
+    count, results = collection.aggregate()
+    assert sum(msg.startswith("SELECT") for msg in caplog.messages) == 1
+
+    assert count == 3
+    for (calc, attr), value in results.items():
+        assert format_value(value, attr) == collection.calc_and_format_value(calc, attr)
+
+
 @pytest.mark.parametrize(
     "order_params",
     [
@@ -1,17 +1,38 @@
 import datetime
+import io
 import itertools
 import json
+import re
 import tempfile
+import zipfile
 from pathlib import Path
 from shutil import which
 
+import gpxpy
 import pytest
 from rich import box
+from sqlalchemy import text
 
-from hiking import commands, interactivity
+from hiking import commands, db_utils, interactivity, models
+from hiking.arg_parsing import parse_arguments
+from hiking.cache import get_track
 from hiking.db_utils import session
 from hiking.exceptions import HikingException, HikingJsonLoaderException
-from hiking.models import Hike
+from hiking.gpx import get_elevation_profile
+from hiking.import_export import (
+    GPXFileWriter,
+    JsonArrayReader,
+    json_exporter,
+    json_importer,
+    write_json_array,
+)
+from hiking.models import (
+    GPXData,
+    Hike,
+    ImportCheckpoint,
+    get_filtered_query,
+    parse_gpx,
+)
 from hiking.tests.utils import ansi_escape
 from hiking.utils import DEFAULT_BOX_STYLE, SlimDateRange
 
@@ -80,10 +101,17 @@ def test_command_create_edit(
         hike = hike_factory(body=None)
         kwargs["pk"] = hike.id
     if set_gpx_as_arg:
-        kwargs["gpx"] = gpx_xml
+        kwargs["gpx"] = parse_gpx(gpx_xml)
+    read_spy = mocker.spy(models, "read_gpx")
+    parse_spy = mocker.spy(gpxpy, "parse")
 
     commands.command_create_edit(**kwargs)
 
+    # the GPX data is read only once, when passed as argument already before
+    assert read_spy.call_count == int(set_gpx_interactively and not set_gpx_as_arg)
+    # and the object model of gpxpy is never built
+    assert parse_spy.call_count == 0
+
     if not do_edit and not do_write:
         assert session.query(Hike).count() == 0
         return
@@ -165,15 +193,84 @@ def test_command_delete_failure(collection):
     assert e.value.args[0] == "No hikes found with provided ID(s)"
 
 
-def test_command_import(snapshot, json_import_data):
+def test_command_import(snapshot, json_import_data, mocker):
+    use_db_profile_spy = mocker.spy(commands, "use_db_profile")
+
     assert session.query(Hike).count() == 0
     commands.command_import(json_import_data)
     assert session.query(Hike).count() == 5
+    use_db_profile_spy.assert_called_once_with("bulk_import")
 
     for hike in session.query(Hike).all():
         assert hike.get_stats() == snapshot
 
 
+@pytest.mark.parametrize("workers", [1, 2])
+def test_json_importer_batches(json_import_data, gpx_file, workers):
+    for raw_hike in json_import_data:
+        raw_hike["gpx_file"] = str(gpx_file.absolute())
+    json_importer(iter(json_import_data), batch_size=2, workers=workers)
+
+    assert session.query(Hike).count() == 5
+    assert session.query(GPXData).count() == 5
+
+
+def test_json_importer_batches_committed(json_import_data):
+    json_import_data[-1]["date"] = "not a date"
+
+    with pytest.raises(HikingJsonLoaderException):
+        json_importer(iter(json_import_data), batch_size=2)
+    # only the batch containing the invalid hike is discarded
+    assert session.query(Hike).count() == 4
+
+
+def test_command_import_resume(capsys, json_import_data, tmp_path):
+    json_path = tmp_path / "hikes.json"
+    valid_date = json_import_data[-1]["date"]
+    json_import_data[-1]["date"] = "not a date"
+    json_path.write_text(json.dumps(json_import_data))
+
+    with json_path.open() as f, pytest.raises(HikingJsonLoaderException):
+        commands.command_import(JsonArrayReader(f), batch_size=2)
+    assert session.query(Hike).count() == 4
+    checkpoint = session.get(ImportCheckpoint, str(json_path))
+    assert checkpoint.imported == 4
+    assert "4 hikes were imported" in capsys.readouterr().out
+
+    json_import_data[-1]["date"] = valid_date
+    json_path.write_text(json.dumps(json_import_data))
+    with json_path.open() as f:
+        commands.command_import(JsonArrayReader(f), batch_size=2, resume=True)
+    assert session.query(Hike).count() == 5
+    assert [hike.name for hike in session.query(Hike)] == [
+        raw_hike["name"] for raw_hike in json_import_data
+    ]
+    assert session.query(ImportCheckpoint).count() == 0
+
+
+@pytest.mark.parametrize("resume", [False, True])
+def test_command_import_resume_changed_file(json_import_data, tmp_path, resume):
+    json_path = tmp_path / "hikes.json"
+    json_import_data[-1]["date"] = "not a date"
+    json_path.write_text(json.dumps(json_import_data))
+    with json_path.open() as f, pytest.raises(HikingJsonLoaderException):
+        commands.command_import(JsonArrayReader(f), batch_size=2)
+
+    json_import_data[0]["name"] = "changed"
+    json_import_data[-1]["date"] = "2022-02-26"
+    json_path.write_text(json.dumps(json_import_data))
+    with json_path.open() as f:
+        if resume:
+            with pytest.raises(HikingJsonLoaderException) as e:
+                commands.command_import(JsonArrayReader(f), resume=resume)
+            assert e.value.args[0] == "Cannot resume import, the file changed since"
+            return
+
+        # without `resume`, everything is imported again
+        commands.command_import(JsonArrayReader(f), resume=resume)
+    assert session.query(Hike).count() == 9
+
+
 @pytest.mark.parametrize("add_gpx", [False, True])
 def test_command_import_update(snapshot, hike, gpx_file, add_gpx):
     assert session.query(Hike).count() == 1
@@ -194,10 +291,12 @@ def test_command_import_update(snapshot, hike, gpx_file, add_gpx):
 
     assert session.query(Hike).count() == 1
     assert session.query(Hike).first().get_stats() == snapshot
-    assert session.query(Hike).first().gpx == snapshot
+    assert (session.query(Hike).first().gpx_xml is not None) is add_gpx
+    assert bool(session.query(Hike).first().track) is add_gpx
 
 
-def test_command_import_failure(snapshot, hike):
+@pytest.mark.parametrize("workers", [1, 2])
+def test_command_import_failure(snapshot, hike, workers):
     assert session.query(Hike).count() == 1
     valid_hike_data = {
         "id": hike.id,
@@ -214,21 +313,21 @@ def test_command_import_failure(snapshot, hike):
     invalid_date["date"] = "not a date"
 
     with pytest.raises(HikingJsonLoaderException) as e:
-        commands.command_import([invalid_date])
+        commands.command_import([invalid_date], workers=workers)
     assert e.value.args[0] == "Wrong date format"
 
     invalid_duration = valid_hike_data.copy()
     invalid_duration["duration"] = "not a duration"
 
     with pytest.raises(HikingJsonLoaderException) as e:
-        commands.command_import([invalid_duration])
+        commands.command_import([invalid_duration], workers=workers)
     assert e.value.args[0] == "Wrong duration format"
 
     non_existent_gpx_file = valid_hike_data.copy()
     non_existent_gpx_file["gpx_file"] = "not/a/file"
 
     with pytest.raises(HikingJsonLoaderException) as e:
-        commands.command_import([non_existent_gpx_file])
+        commands.command_import([non_existent_gpx_file], workers=workers)
     assert e.value.args[0] == '*.gpx file "not/a/file" not found'
 
     with tempfile.NamedTemporaryFile(suffix=".gpx", mode="w+") as tf:
@@ -239,7 +338,7 @@ def test_command_import_failure(snapshot, hike):
         invalid_gpx_file["gpx_file"] = tf.name
 
         with pytest.raises(HikingJsonLoaderException) as e:
-            commands.command_import([invalid_gpx_file])
+            commands.command_import([invalid_gpx_file], workers=workers)
         assert e.value.args[0] == "Error parsing XML: syntax error: line 1, column 0"
 
     assert session.query(Hike).count() == 1
@@ -286,6 +385,209 @@ def test_command_export_with_ids(snapshot, collection, export_dir):
     assert data == snapshot
 
 
+def test_command_export_batches(hike_factory, gpx_xml, export_dir):
+    hikes = hike_factory.create_batch(5)
+    for hike in hikes[:3]:
+        hike.gpx_xml = gpx_xml
+        hike.save()
+
+    export_dir = Path(export_dir)
+    json_exporter(get_filtered_query(load_all_columns=True), export_dir, batch_size=2)
+
+    with (export_dir / "hikes.json").open("r") as f:
+        data = json.loads(f.read())
+    assert [raw_hike["name"] for raw_hike in data] == [hike.name for hike in hikes]
+    assert sorted(path.name for path in (export_dir / "gpx").iterdir()) == sorted(
+        f"{hike.id}.gpx" for hike in hikes[:3]
+    )
+
+
+def test_command_export_gpx_files(hike_factory, gpx_xml, export_dir):
+    other_gpx_xml = f"{gpx_xml}\n"
+    hikes = hike_factory.create_batch(4)
+    for hike, xml in zip(hikes, [gpx_xml, gpx_xml, gpx_xml, other_gpx_xml]):
+        hike.gpx_xml = xml
+        hike.save()
+
+    export_dir = Path(export_dir)
+    paths = [export_dir / "gpx" / f"{hike.id}.gpx" for hike in hikes]
+
+    def export():
+        json_exporter(get_filtered_query(load_all_columns=True), export_dir)
+        return [(path.stat().st_ino, path.stat().st_mtime_ns) for path in paths]
+
+    stats = export()
+    # duplicates are hardlinks
+    assert paths[0].samefile(paths[1])
+    assert paths[0].samefile(paths[2])
+    assert not paths[0].samefile(paths[3])
+
+    # files which are up to date aren't written again
+    assert export() == stats
+
+    hikes[0].gpx_xml = other_gpx_xml
+    hikes[0].save()
+    export()
+    assert paths[0].samefile(paths[3])
+    assert paths[1].samefile(paths[2])
+    assert [path.read_text() for path in paths] == [
+        other_gpx_xml,
+        gpx_xml,
+        gpx_xml,
+        other_gpx_xml,
+    ]
+
+
+def test_command_export_gpx_files_no_hardlinks(mocker, hike_factory, gpx_xml):
+    mocker.patch.object(Path, "hardlink_to", side_effect=OSError)
+    hikes = hike_factory.create_batch(2)
+    for hike in hikes:
+        hike.gpx_xml = gpx_xml
+        hike.save()
+
+    with tempfile.TemporaryDirectory() as export_dir:
+        export_dir = Path(export_dir)
+        json_exporter(get_filtered_query(load_all_columns=True), export_dir)
+        with (export_dir / "hikes.json").open("r") as f:
+            data = json.loads(f.read())
+
+        # the duplicate references the first file
+        assert [raw_hike["gpx_file"] for raw_hike in data] == [
+            str(export_dir / "gpx" / f"{hikes[0].id}.gpx")
+        ] * 2
+        assert len(list((export_dir / "gpx").iterdir())) == 1
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_command_export_import_archive(hike_factory, gpx_xml, export_dir, workers):
+    other_gpx_xml = f"{gpx_xml}\n"
+    hikes = hike_factory.create_batch(4)
+    for hike, xml in zip(hikes, [gpx_xml, gpx_xml, other_gpx_xml]):
+        hike.gpx_xml = xml
+        hike.save()
+    expected = [(hike.name, hike.gpx_xml) for hike in hikes]
+
+    export_dir = Path(export_dir)
+    commands.command_export(
+        export_dir=export_dir,
+        ids=[],
+        daterange=None,
+        include_ids=False,
+        archive=True,
+    )
+    assert [path.name for path in export_dir.iterdir()] == ["hikes.zip"]
+    with zipfile.ZipFile(export_dir / "hikes.zip") as zip_file:
+        # duplicates are only stored once
+        assert sorted(zip_file.namelist()) == [
+            f"gpx/{hikes[0].id}.gpx",
+            f"gpx/{hikes[2].id}.gpx",
+            "hikes.json",
+        ]
+        assert {info.compress_type for info in zip_file.infolist()} == {
+            zipfile.ZIP_DEFLATED
+        }
+
+    for hike in hikes:
+        hike.delete()
+    args = parse_arguments(["import", str(export_dir / "hikes.zip")])
+    commands.command_import(args.json_data, workers=workers)
+
+    assert [(hike.name, hike.gpx_xml) for hike in session.query(Hike)] == expected
+    assert session.get(ImportCheckpoint, str(export_dir / "hikes.zip")) is None
+
+
+def test_command_import_archive_failure(gpx_xml, export_dir):
+    archive = Path(export_dir) / "hikes.zip"
+    with zipfile.ZipFile(archive, "w") as zip_file:
+        zip_file.writestr("foo.json", "[]")
+    with pytest.raises(SystemExit):
+        parse_arguments(["import", str(archive)])
+
+    hike_data = {
+        "name": "hike",
+        "date": "2022-02-26",
+        "distance": 5.0,
+        "elevation_gain": 298,
+        "elevation_loss": 298,
+        "duration": 75,
+        "gpx_file": "gpx/1.gpx",
+    }
+    with zipfile.ZipFile(archive, "w") as zip_file:
+        zip_file.writestr("hikes.json", json.dumps([hike_data]))
+    with pytest.raises(HikingJsonLoaderException) as e:
+        commands.command_import(JsonArrayReader.from_archive(archive))
+    assert e.value.args[0] == '*.gpx file "gpx/1.gpx" not found in archive'
+
+
+def test_gpx_file_writer(gpx_xml, export_dir):
+    gpx_dir = Path(export_dir) / "gpx"
+    with GPXFileWriter(gpx_dir, workers=1) as writer:
+        for i in range(5):
+            writer.write(f"{i}.gpx", f"{gpx_xml}{' ' * i}")
+    assert len(list(gpx_dir.iterdir())) == 5
+
+
+@pytest.mark.parametrize("items", [[], [1], [{"a": [1, {"b": "c\nd"}]}, "e", None]])
+def test_write_json_array(items):
+    file = io.StringIO()
+    write_json_array(file, iter(items))
+    assert file.getvalue() == json.dumps(items, indent=4)
+
+
+def test_command_cache(capsys, hike, gpx_xml, cache_dir):
+    get_track(gpx_xml)
+    hike.gpx_xml = gpx_xml
+    get_elevation_profile(hike)
+
+    commands.command_cache("stats")
+    stats = capsys.readouterr()[0]
+    assert "Track cache" in stats
+    assert str(cache_dir) in stats
+    assert re.search(r"Tracks +1 ", stats)
+    assert re.search(r"Plots +1 ", stats)
+    assert "256 MiB" in stats
+
+    commands.command_cache("clear")
+    assert capsys.readouterr()[0] == "Removed 2 cache entries\n"
+
+
+@pytest.mark.parametrize("compression", ["zlib", "lzma"])
+def test_command_compress(monkeypatch, capsys, hike_factory, gpx_xml, compression):
+    monkeypatch.setattr(db_utils, "GPX_COMPRESSION", compression)
+    hike_with_gpx, hike_without_gpx = hike_factory.create_batch(2)
+    # simulate GPX data stored before compression was introduced
+    session.execute(
+        text("INSERT INTO gpx_data (hike_id, xml) VALUES (:id, :gpx_xml)"),
+        {"gpx_xml": gpx_xml, "id": hike_with_gpx.id},
+    )
+    session.commit()
+
+    def get_stored_type():
+        return session.execute(text("SELECT typeof(xml) FROM gpx_data")).scalar()
+
+    assert get_stored_type() == "text"
+    assert session.get(Hike, hike_with_gpx.id).gpx_xml == gpx_xml
+
+    commands.command_compress()
+
+    assert capsys.readouterr()[0] == "Compressed GPX data of 1 hikes\n"
+    assert get_stored_type() == "blob"
+    assert session.get(Hike, hike_without_gpx.id).gpx_xml is None
+    session.expire_all()
+    assert session.get(Hike, hike_with_gpx.id).gpx_xml == gpx_xml
+
+
+def test_command_rebuild(capsys, hike_factory):
+    hike_factory(date=datetime.date(2023, 1, 2))
+    hike_factory(date=datetime.date(2024, 1, 2))
+
+    commands.command_rebuild()
+
+    assert capsys.readouterr()[0] == (
+        "Rebuilt the totals of 2 days, 2 months and 2 years\n"
+    )
+
+
 @pytest.mark.parametrize(
     "has_gpx, open_external_viewer, has_gpx_viewer",
     [
@@ -420,6 +722,24 @@ def test_command_show_list(
     assert ansi_escape(captured) == snapshot
 
 
+@pytest.mark.parametrize("group_by", ["week", "month", "year"])
+def test_command_show_group_by(capsys, snapshot, collection, group_by):
+    commands.command_show(
+        [],
+        SlimDateRange(datetime.date.min, datetime.date.max),
+        None,
+        DEFAULT_BOX_STYLE,
+        ("date", False),
+        False,
+        (),
+        group_by,
+    )
+
+    captured = capsys.readouterr()[0]
+
+    assert ansi_escape(captured) == snapshot
+
+
 def test_command_show_no_hikes():
     with pytest.raises(HikingException) as e:
         commands.command_show(
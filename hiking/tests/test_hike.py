@@ -1,11 +1,54 @@
 import datetime
+import io
+import math
+import os
+import re
+from array import array
 
+import gpxpy
 import pytest
 from gpxpy.gpx import GPX
+from sqlalchemy import inspect, text
+from sqlalchemy.exc import OperationalError
 
-from hiking.db_utils import session
-from hiking.gpx import get_elevation_profile
-from hiking.models import Hike
+from hiking import cache, gpx, models
+from hiking.cache import (
+    clear_cache,
+    get_cache_entries,
+    get_cache_path,
+    get_track,
+    prune_cache,
+)
+from hiking.db_utils import (
+    CompressedText,
+    PackedTrack,
+    Seconds,
+    engine,
+    get_db_pragmas,
+    session,
+    use_db_profile,
+)
+from hiking.gpx import downsample, get_elevation_profile
+from hiking.models import (
+    HIKE_ROLLUPS,
+    SCHEMA_VERSION,
+    GPXData,
+    Hike,
+    create_missing_indexes,
+    create_search_index,
+    create_tables,
+    get_filtered_query,
+    get_index_names,
+    get_period_bounds,
+    get_schema_version,
+    get_search_query,
+    migrate_duration_to_seconds,
+    migrate_gpx_to_side_table,
+    rebuild_rollups,
+    set_schema_version,
+)
+from hiking.tests.utils import random_gpx
+from hiking.track import HEADER, SEGMENTS_HEADER, Track, read_gpx
 
 
 def test_hike(hike, snapshot):
@@ -23,19 +66,49 @@ def test_hike(hike, snapshot):
     assert session.query(Hike).first().name == "new name"
 
 
+def test_hike_speed_expression(hike_factory):
+    hikes = hike_factory.create_batch(3)
+    by_speed = sorted(hikes, key=lambda h: h.speed)
+
+    query = session.query(Hike)
+    assert query.order_by(Hike.speed).all() == by_speed
+    assert (
+        query.filter(Hike.speed > by_speed[0].speed).order_by(Hike.speed).all()
+        == by_speed[1:]
+    )
+    assert query.with_entities(Hike.speed).order_by(Hike.speed.desc()).first()[
+        0
+    ] == pytest.approx(by_speed[-1].speed)
+
+    # without the seconds part of the duration, the speed is NULL in both
+    full_day = hike_factory(duration=datetime.timedelta(days=1))
+    assert full_day.speed is None
+    assert full_day.get_pretty_value("speed") == "-"
+    assert full_day.get_detail_stats()["km/h"] is None
+    assert query.filter(Hike.speed.is_(None)).all() == [full_day]
+
+
 def test_hike_load_gpx(hike, gpx_xml):
     hike.load_gpx(gpx_xml)
-    assert isinstance(hike.gpx, GPX)
-    assert hike.name == hike.gpx.name
-    assert hike.date == hike.gpx.time.date()
-    assert hike.distance == round(hike.gpx.length_3d() / 1000, 2)
-    assert hike.elevation_gain == round(hike.gpx.get_uphill_downhill().uphill)
-    assert hike.elevation_loss == round(hike.gpx.get_uphill_downhill().downhill)
+    gpx = gpxpy.parse(gpx_xml)
+    assert hike.name == gpx.name
+    assert hike.date == gpx.time.date()
+    assert hike.distance == round(gpx.length_3d() / 1000, 2)
+    assert hike.elevation_gain == round(gpx.get_uphill_downhill().uphill)
+    assert hike.elevation_loss == round(gpx.get_uphill_downhill().downhill)
     assert hike.gpx_xml == gpx_xml
     # duration differs, because our test gpx file has no timestamps
     hike.save()
 
 
+def test_hike_load_gpx_duration(hike):
+    gpx = random_gpx(seed=1)
+
+    hike.load_gpx(gpx.to_xml())
+
+    assert hike.duration == datetime.timedelta(seconds=gpx.get_duration())
+
+
 @pytest.mark.parametrize("add_gpx", [True, False])
 def test_hike_gpx_elevation_profile(add_gpx, hike, gpx_xml, snapshot):
     if add_gpx:
@@ -46,6 +119,31 @@ def test_hike_gpx_elevation_profile(add_gpx, hike, gpx_xml, snapshot):
     assert ele_profile == snapshot
 
 
+def test_elevation_profile_cache(hike, gpx_xml, cache_dir, mocker):
+    plot_spy = mocker.spy(gpx, "plot")
+    hike.gpx_xml = gpx_xml
+
+    profile = get_elevation_profile(hike)
+    assert get_elevation_profile(hike) == profile
+    assert plot_spy.call_count == 1
+
+    # unreadable entries are rendered again
+    (plot_path,) = cache_dir.glob("*.plot")
+    plot_path.write_bytes(b"\xff")
+    assert get_elevation_profile(hike) == profile
+    assert plot_spy.call_count == 2
+
+    mocker.patch.object(gpx, "get_plot_width", return_value=100)
+    assert get_elevation_profile(hike) != profile
+    assert plot_spy.call_count == 3
+
+    # the cached profile of the previous GPX data isn't used
+    hike.gpx_xml = random_gpx(seed=1, points=10).to_xml()
+    get_elevation_profile(hike)
+    assert plot_spy.call_count == 4
+    assert len(list(cache_dir.glob("*.plot"))) == 3
+
+
 def test_hike_save_delete():
     hike = Hike(
         name="Foo",
@@ -66,3 +164,547 @@ def test_hike_save_delete():
     assert q.first().name == "Bar"
     hike.delete()
     assert q.count() == 0
+
+
+def test_seconds_type():
+    value = datetime.timedelta(minutes=90, microseconds=5)
+    assert Seconds().process_bind_param(value, None) == 5400
+    assert Seconds().process_result_value(5400, None) == datetime.timedelta(minutes=90)
+
+
+@pytest.mark.parametrize("column_type", [Seconds(), PackedTrack(), CompressedText()])
+def test_column_types_none(column_type):
+    assert column_type.process_bind_param(None, None) is None
+    assert column_type.process_result_value(None, None) is None
+
+
+@pytest.mark.parametrize(
+    "profile, overrides, expected",
+    [
+        ("interactive", "", {"synchronous": "NORMAL", "cache_size": -16384}),
+        ("bulk_import", "", {"synchronous": "OFF", "cache_size": -262144}),
+        ("reporting", " cache_size = -1024,", {"cache_size": "-1024"}),
+        ("reporting", "mmap_size=0,synchronous=FULL", {"synchronous": "FULL"}),
+        ("unknown", "", 'Unknown database profile "unknown"'),
+        ("interactive", "page_size=1", 'Invalid database pragma "page_size=1"'),
+        ("interactive", "cache_size", 'Invalid database pragma "cache_size"'),
+        ("interactive", "mmap_size=0;", 'Invalid database pragma "mmap_size=0;"'),
+    ],
+)
+def test_get_db_pragmas(profile, overrides, expected):
+    if isinstance(expected, str):
+        with pytest.raises(ValueError, match=expected):
+            get_db_pragmas(profile, overrides)
+        return
+
+    assert get_db_pragmas(profile, overrides).items() >= expected.items()
+
+
+def test_use_db_profile():
+    def get_pragmas():
+        with engine.connect() as connection:
+            return [
+                connection.exec_driver_sql(f"PRAGMA {name}").scalar()
+                for name in ["synchronous", "cache_size"]
+            ]
+
+    assert get_pragmas() == [1, -16384]
+    with use_db_profile("bulk_import"):
+        assert get_pragmas() == [0, -262144]
+    assert get_pragmas() == [1, -16384]
+
+
+def test_reporting_db_profile_read_only(hike):
+    with use_db_profile("reporting"), engine.connect() as connection:
+        assert connection.exec_driver_sql("SELECT count(*) FROM hikes").scalar() == 1
+        with pytest.raises(OperationalError, match="readonly"):
+            connection.exec_driver_sql("DELETE FROM hikes")
+
+    # other profiles are writable again
+    with engine.connect() as connection:
+        assert connection.exec_driver_sql("PRAGMA query_only").scalar() == 0
+
+
+def test_create_tables_up_to_date(mocker):
+    create_all_mock = mocker.patch.object(models.Base.metadata, "create_all")
+
+    create_tables()
+
+    assert get_schema_version() == SCHEMA_VERSION
+    create_all_mock.assert_not_called()
+
+
+def test_create_tables_migrations(mocker, monkeypatch):
+    migrations = [mocker.Mock() for _ in range(SCHEMA_VERSION)]
+    monkeypatch.setattr(models, "MIGRATIONS", migrations)
+    set_schema_version(SCHEMA_VERSION - 2)
+
+    try:
+        create_tables()
+    finally:
+        set_schema_version(SCHEMA_VERSION)
+
+    assert [m.call_count for m in migrations] == [0] * (SCHEMA_VERSION - 2) + [1, 1]
+
+
+def test_create_tables_from_unversioned():
+    set_schema_version(0)
+
+    create_tables()
+
+    assert get_schema_version() == SCHEMA_VERSION
+
+
+def get_rollups() -> list[tuple]:
+    return session.query(HIKE_ROLLUPS).order_by(*HIKE_ROLLUPS.primary_key).all()
+
+
+def assert_rollups_up_to_date():
+    rollups = get_rollups()
+    rebuild_rollups()
+    assert rollups == get_rollups()
+
+
+def test_rollups(hike_factory, mocker):
+    refresh_spy = mocker.spy(models, "refresh_rollups")
+    hikes = [
+        hike_factory(date=datetime.date(2023, month, day))
+        for month, day in [(1, 2), (1, 31), (2, 1), (12, 31)]
+    ]
+    assert_rollups_up_to_date()
+    assert session.query(HIKE_ROLLUPS.c.bucket).filter_by(period="month").all() == [
+        ("2023-01",),
+        ("2023-02",),
+        ("2023-12",),
+    ]
+
+    # moves the hike to the rollups of another day, month and year
+    hikes[0].date = datetime.date(2024, 2, 29)
+    hikes[1].duration += datetime.timedelta(hours=1)
+    hikes[0].save()
+    assert_rollups_up_to_date()
+
+    refresh_spy.reset_mock()
+    hikes[2].name = "No change of the rollups"
+    hikes[2].save()
+    refresh_spy.assert_not_called()
+
+    for hike in hikes:
+        hike.delete()
+    assert get_rollups() == []
+
+
+def test_rebuild_rollups(hike_factory):
+    hike_factory(date=datetime.date(2023, 1, 2))
+    hike_factory(date=datetime.date(2023, 1, 3))
+    session.execute(HIKE_ROLLUPS.delete())
+
+    assert rebuild_rollups() == {"day": 2, "month": 1, "year": 1}
+    assert session.query(HIKE_ROLLUPS.c.count_id).filter_by(period="year").scalar() == 2
+
+
+def test_get_period_bounds():
+    date = datetime.date(2024, 2, 10)
+    assert get_period_bounds("day", date) == (date, date)
+    assert get_period_bounds("month", date) == (
+        datetime.date(2024, 2, 1),
+        datetime.date(2024, 2, 29),
+    )
+    assert get_period_bounds("year", date) == (
+        datetime.date(2024, 1, 1),
+        datetime.date(2024, 12, 31),
+    )
+
+
+def test_migrate_duration_to_seconds(hike_factory, monkeypatch):
+    monkeypatch.setattr(models, "MIGRATION_BATCH_SIZE", 2)
+    hikes = hike_factory.create_batch(3)
+    # simulate a database storing `duration` as `Interval`
+    with engine.begin() as connection:
+        connection.execute(text("DROP INDEX ix_hikes_duration"))
+        connection.execute(
+            text("UPDATE hikes SET duration = '1970-01-02 02:30:00.000000'")
+        )
+
+    migrate_duration_to_seconds()
+    # running it again is a noop
+    migrate_duration_to_seconds()
+
+    session.expire_all()
+    for hike in hikes:
+        assert session.get(Hike, hike.id).duration == datetime.timedelta(
+            days=1, hours=2, minutes=30
+        )
+    assert "ix_hikes_duration" in get_index_names()
+
+
+def test_create_missing_indexes():
+    # simulate a database created before the indexes were added
+    with engine.begin() as connection:
+        for name in ["ix_hikes_date", "ix_hikes_speed"]:
+            connection.execute(text(f"DROP INDEX {name}"))
+
+    create_missing_indexes()
+    # running it again is a noop
+    create_missing_indexes()
+
+    assert {"ix_hikes_date", "ix_hikes_speed"} <= get_index_names()
+
+
+# the track stores distances and elevations as float32
+TRACK_METRICS_TOLERANCE = {"rel": 1e-5, "abs": 1e-3}
+
+
+@pytest.mark.parametrize("seed", [None, 1, 2, 3])
+def test_track_metrics(gpx_xml, seed):
+    gpx = gpxpy.parse(gpx_xml) if seed is None else random_gpx(seed)
+    track = read_gpx(gpx.to_xml()).track
+
+    assert track.length_3d() == pytest.approx(
+        gpx.length_3d(), **TRACK_METRICS_TOLERANCE
+    )
+    assert track.get_uphill_downhill() == pytest.approx(
+        tuple(gpx.get_uphill_downhill()), **TRACK_METRICS_TOLERANCE
+    )
+    assert track.get_duration() == gpx.get_duration()
+    assert track.get_moving_time() == pytest.approx(
+        gpx.get_moving_data().moving_time, **TRACK_METRICS_TOLERANCE
+    )
+
+
+@pytest.mark.parametrize("untimed", [[0], [1, 2], [0, 1, 2, 3]])
+def test_track_duration_untimed_segments(untimed):
+    gpx = random_gpx(seed=1)
+    segments = [segment for track in gpx.tracks for segment in track.segments]
+    for i in untimed:
+        for point in segments[i].points:
+            point.time = None
+    track = read_gpx(gpx.to_xml()).track
+
+    # gpxpy has no duration for the whole GPX as soon as a segment has none
+    durations = [segment.get_duration() for segment in segments]
+    assert gpx.get_duration() is None
+    if len(untimed) == len(segments):
+        assert track.get_duration() is None
+    else:
+        assert track.get_duration() == sum(duration or 0 for duration in durations)
+
+
+def test_read_gpx(gpx_xml):
+    gpx = gpxpy.parse(gpx_xml)
+    info = read_gpx(io.BytesIO(gpx_xml.encode()))
+
+    assert info.name == gpx.name
+    assert info.time == gpx.time
+    assert list(info.track.latitude) == [
+        point.point.latitude for point in gpx.get_points_data()
+    ]
+
+    prefixed = read_gpx(
+        '<g:gpx xmlns:g="http://www.topografix.com/GPX/1/1"><g:trk><g:trkseg>'
+        '<g:trkpt lat="1" lon="2"><g:ele>3</g:ele></g:trkpt>'
+        "</g:trkseg></g:trk></g:gpx>"
+    )
+    assert prefixed.name is None
+    assert list(prefixed.track.elevation) == [3]
+
+
+@pytest.mark.parametrize(
+    ("point", "error"),
+    [
+        ('<trkpt lat="1"/>', "Invalid <trkpt> coordinates: {'lat': '1'}"),
+        ('<trkpt lat="1" lon="x"/>', "Invalid <trkpt> coordinates: "),
+        ('<trkpt lat="1" lon="2"><ele>a</ele></trkpt>', "Invalid value for <ele>: a"),
+        (
+            '<trkpt lat="1" lon="2"><time>yesterday</time></trkpt>',
+            "Invalid value for <time>: yesterday",
+        ),
+        ("<trkpt", "Error parsing XML: not well-formed (invalid token)"),
+    ],
+)
+def test_read_gpx_invalid(point, error):
+    with pytest.raises(ValueError, match=re.escape(error)):
+        read_gpx(f"<gpx><trk><trkseg>{point}</trkseg></trk></gpx>")
+
+
+def test_track_from_bytes_version_1(gpx_xml):
+    track = read_gpx(gpx_xml).track
+    data = track.to_bytes()
+    # version 1 had no segments
+    segments_size = SEGMENTS_HEADER.size + track.segments.itemsize * 2
+    data_v1 = HEADER.pack(1, len(track)) + data[HEADER.size + SEGMENTS_HEADER.size :]
+    data_v1 = data_v1[: len(data) - segments_size]
+
+    track_v1 = Track.from_bytes(data_v1)
+
+    assert list(track_v1.segments) == [0]
+    assert list(track_v1.latitude) == list(track.latitude)
+    assert Track.from_bytes(HEADER.pack(1, 0)).segments == array("I")
+
+
+def test_empty_track():
+    track = read_gpx(GPX().to_xml()).track
+
+    assert len(track) == 0
+    assert track.length_3d() == 0
+    assert track.get_uphill_downhill() == (0, 0)
+    assert track.get_duration() == 0
+    assert track.get_moving_time() == 0
+
+
+def test_track_short_segments():
+    gpx = random_gpx(seed=1, tracks=1, segments=3, points=2)
+    gpx.tracks[0].segments[0].points.clear()
+    gpx.tracks[0].segments[1].points.pop()
+
+    track = read_gpx(gpx.to_xml()).track
+
+    assert list(track.segments) == [0, 1]
+    assert track.length_3d() == pytest.approx(
+        gpx.length_3d(), **TRACK_METRICS_TOLERANCE
+    )
+    assert track.get_uphill_downhill() == pytest.approx(
+        tuple(gpx.get_uphill_downhill()), **TRACK_METRICS_TOLERANCE
+    )
+    assert track.get_duration() == gpx.get_duration()
+
+
+def test_track_cache(gpx_xml, cache_dir, mocker):
+    read_spy = mocker.spy(cache, "read_gpx")
+    path = get_cache_path(gpx_xml)
+
+    track = get_track(gpx_xml)
+    assert read_spy.call_count == 1
+    assert path.parent == cache_dir
+    assert path.read_bytes() == track.to_bytes()
+
+    assert get_track(gpx_xml).to_bytes() == track.to_bytes()
+    assert read_spy.call_count == 1
+
+    # unreadable entries are replaced
+    path.write_bytes(b"")
+    assert get_track(gpx_xml).to_bytes() == track.to_bytes()
+    assert read_spy.call_count == 2
+    assert path.read_bytes() == track.to_bytes()
+
+
+def test_track_cache_not_writable(gpx_xml, cache_dir):
+    cache_dir.write_text("not a directory")
+
+    assert len(get_track(gpx_xml)) == 40
+    assert get_cache_entries() == []
+
+
+def test_prune_cache(cache_dir):
+    xmls = [random_gpx(seed, points=10).to_xml() for seed in range(3)]
+    for i, xml in enumerate(xmls):
+        get_track(xml)
+        os.utime(get_cache_path(xml), (i, i))
+    # left behind by an interrupted write
+    (cache_dir / "interrupted.tmp").write_bytes(b"")
+    sizes = [get_cache_path(xml).stat().st_size for xml in xmls]
+    # the first track becomes the most recently used one
+    get_track(xmls[0])
+
+    assert prune_cache(max_size=sum(sizes)) == 0
+    assert prune_cache(max_size=sizes[0] + sizes[2]) == 1
+    assert [path for path, _ in get_cache_entries()] == [
+        get_cache_path(xmls[2]),
+        get_cache_path(xmls[0]),
+    ]
+    assert clear_cache() == 2
+    assert get_cache_entries() == []
+
+
+def test_hike_track(hike, gpx_xml):
+    assert hike.track is None
+
+    hike.gpx_xml = gpx_xml
+    hike.save()
+    session.expire_all()
+
+    track = session.get(Hike, hike.id).track
+    points_data = gpxpy.parse(gpx_xml).get_points_data()
+    assert len(track) == len(points_data) == 40
+    assert track.distance[-1] == pytest.approx(points_data[-1].distance_from_start)
+    assert list(track.latitude) == [p.point.latitude for p in points_data]
+    assert Track.from_bytes(track.to_bytes()).to_bytes() == track.to_bytes()
+
+    hike.gpx_xml = None
+    assert hike.track is None
+
+
+@pytest.mark.parametrize("with_track_column", [True, False])
+def test_migrate_gpx_to_side_table(
+    hike_factory, gpx_xml, with_track_column, monkeypatch
+):
+    monkeypatch.setattr(models, "MIGRATION_BATCH_SIZE", 1)
+    hike_with_gpx, hike_without_gpx = hike_factory.create_batch(2)
+    # simulate a database storing GPX data in the `hikes` table
+    with engine.begin() as connection:
+        connection.execute(text("ALTER TABLE hikes ADD COLUMN gpx_xml TEXT"))
+        if with_track_column:
+            connection.execute(text("ALTER TABLE hikes ADD COLUMN track BLOB"))
+        connection.execute(
+            text("UPDATE hikes SET gpx_xml = :gpx_xml WHERE id = :id"),
+            {"gpx_xml": gpx_xml, "id": hike_with_gpx.id},
+        )
+
+    migrate_gpx_to_side_table()
+    # running it again is a noop
+    migrate_gpx_to_side_table()
+
+    columns = {column["name"] for column in inspect(engine).get_columns("hikes")}
+    assert not {"gpx_xml", "track"} & columns
+    assert session.query(GPXData).count() == 1
+
+    session.expire_all()
+    assert session.get(Hike, hike_with_gpx.id).gpx_xml == gpx_xml
+    assert len(session.get(Hike, hike_with_gpx.id).track) == 40
+    assert session.get(Hike, hike_without_gpx.id).gpx_xml is None
+
+
+def test_migrate_gpx_to_side_table_unreadable(
+    hike_factory, gpx_xml, caplog, monkeypatch
+):
+    monkeypatch.setattr(models, "MIGRATION_BATCH_SIZE", 1)
+    unreadable, readable = hike_factory.create_batch(2)
+    # simulate GPX data stored before `track` was introduced
+    session.execute(
+        text("INSERT INTO gpx_data (hike_id, xml) VALUES (:id, :xml)"),
+        [
+            {"id": unreadable.id, "xml": '<gpx><trk><trkseg><trkpt lat="x"/>'},
+            {"id": readable.id, "xml": gpx_xml},
+        ],
+    )
+    session.commit()
+
+    migrate_gpx_to_side_table()
+
+    assert [
+        message for name, _, message in caplog.record_tuples if name == models.__name__
+    ] == [
+        f"Cannot read the GPX data of hike {unreadable.id}: "
+        "Invalid <trkpt> coordinates: {'lat': 'x'}"
+    ]
+    session.expire_all()
+    assert session.get(Hike, unreadable.id).track is None
+    assert len(session.get(Hike, readable.id).track) == 40
+
+
+def test_hike_delete_gpx_data(hike, gpx_xml):
+    hike.gpx_xml = gpx_xml
+    hike.save()
+    assert session.query(GPXData).count() == 1
+
+    hike.delete()
+    assert session.query(GPXData).count() == 0
+
+
+def test_downsample():
+    x = [i / 10 for i in range(1000)]
+    y = [math.sin(i / 50) * 100 for i in range(1000)]
+    y[123] = 500
+    y[456] = -500
+
+    ds_x, ds_y = downsample(x, y, buckets=10)
+
+    assert len(ds_x) == len(ds_y) <= 40
+    assert ds_x == sorted(ds_x)
+    assert (ds_x[0], ds_x[-1]) == (x[0], x[-1])
+    assert (max(ds_y), min(ds_y)) == (500, -500)
+    # every point is kept, if there are not more than the buckets could hold
+    assert downsample(x[:40], y[:40], buckets=10) == (x[:40], y[:40])
+    # all `x` are the same
+    assert downsample([1] * 52, [0, 5, -5, 1] * 13, buckets=10) == (
+        [1] * 4,
+        [0, 5, -5, 1],
+    )
+
+
+def test_hike_elevation_profile_missing_elevation(hike, gpx_xml):
+    hike.gpx_xml = gpx_xml
+    expected = get_elevation_profile(hike)
+
+    hike.track.distance.insert(0, 0)
+    hike.track.elevation.insert(0, math.nan)
+    assert get_elevation_profile(hike) == expected
+
+
+def test_hike_elevation_profile_no_elevation(hike, gpx_xml):
+    hike.gpx_xml = gpx_xml
+    hike.track.elevation = array("f", [math.nan] * len(hike.track))
+
+    assert get_elevation_profile(hike) == "No elevation data available"
+
+
+@pytest.mark.parametrize(
+    "search, expected",
+    [
+        ("zurich", ["Lake"]),
+        ("ZÜRICH", ["Lake"]),
+        ("mountain", ["Mountain", "Lake"]),
+        ("mount*", ["Mountain", "Lake"]),
+        ("reach", ["Mountain"]),
+        ("hik", ["Shooter's hike"]),
+        ('"lake Zürich"', ["Lake"]),
+        ('"Zürich lake"', []),
+        ("summit lake", []),
+        ("summit OR lake", []),
+        ("shooter's hike", ["Shooter's hike"]),
+        ("7.4", ["Shooter's hike"]),
+        ("a-b", ["Shooter's hike"]),
+        ("AND", ["Shooter's hike"]),
+        ('"unbalanced', []),
+        ("'", []),
+    ],
+)
+def test_search(hike_factory, search, expected):
+    hike_factory(name="Mountain", body="Reached the summit")
+    hike_factory(name="Lake", body="Walking around lake Zürich, mountains ahead")
+    hike_factory(name="Shooter's hike", body="7.4 km on the a-b trail AND back")
+
+    assert [hike.name for hike in get_filtered_query(search=search)] == expected
+
+
+@pytest.mark.parametrize(
+    "search, expected",
+    [
+        ("hike to", '"hike"* "to"*'),
+        ("hik* OR", '"hik"* "OR"*'),
+        ('"hike to" lake', '"hike to" "lake"*'),
+        ("adrenaline's 7.4", '"adrenaline\'s"* "7.4"*'),
+        ('"unbalanced', '"unbalanced"*'),
+        ('* "" " "', ""),
+    ],
+)
+def test_get_search_query(search, expected):
+    assert get_search_query(search) == expected
+
+
+def test_search_index_sync(hike_factory):
+    hike = hike_factory(name="Mountain", body=None)
+    assert get_filtered_query(search="mountain").count() == 1
+
+    hike.name = "Lake"
+    hike.save()
+    assert get_filtered_query(search="mountain").count() == 0
+    assert get_filtered_query(search="lake").count() == 1
+
+    hike.delete()
+    assert get_filtered_query(search="lake").count() == 0
+
+
+def test_create_search_index(hike_factory):
+    hike_factory(name="Mountain")
+    # simulate a database without search index
+    with engine.begin() as connection:
+        connection.execute(text("DROP TABLE hikes_fts"))
+        for trigger in ["insert", "update", "delete"]:
+            connection.execute(text(f"DROP TRIGGER hikes_fts_{trigger}"))
+
+    create_search_index()
+    # running it again is a noop
+    create_search_index()
+
+    assert get_filtered_query(search="mountain").count() == 1
@@ -1,5 +1,8 @@
+import os
+import subprocess
 import sys
 from collections import namedtuple
+from pathlib import Path
 
 import pytest
 
@@ -25,10 +28,31 @@ ArgsMock = namedtuple(  # noqa: PYI024
         "export_dir",
         "include_ids",
         "debug",
+        "workers",
+        "batch_size",
+        "resume",
+        "archive",
+        "action",
     ],
-    defaults=(None,) * 14,  # `command` is required
+    defaults=(None,) * 19,  # `command` is required
 )
 
+# Modules imported by `show`, instead of their import time which varies between
+# machines. Most of them come from SQLAlchemy and rich.
+SHOW_IMPORT_BUDGET = 475
+SHOW_HIKING_MODULES = {
+    "hiking",
+    "hiking.arg_parsing",
+    "hiking.cache",
+    "hiking.collection",
+    "hiking.commands",
+    "hiking.db_utils",
+    "hiking.exceptions",
+    "hiking.models",
+    "hiking.track",
+    "hiking.utils",
+}
+
 
 @pytest.mark.parametrize("debug", [False, True])
 def test_main_end_to_end(
@@ -45,7 +69,7 @@ def test_main_end_to_end(
 
     # hacky query count :)
     assert sum(msg.startswith("SELECT") for msg in caplog.messages) == (
-        25 if debug else 0
+        4 if debug else 0
     ), "\n".join(caplog.messages)
 
 
@@ -56,6 +80,9 @@ def test_main_end_to_end(
         ("command_delete", ["delete"]),
         ("command_import", ["import"]),
         ("command_export", ["export", "/tmp/"]),  # noqa: S108  # TODO: maybe
+        ("command_compress", ["compress"]),
+        ("command_rebuild", ["rebuild"]),
+        ("command_cache", ["cache", "stats"]),
     ],
 )
 def test_main_commands(mocker, sys_argv, command, args):
@@ -71,7 +98,9 @@ def test_main_commands(mocker, sys_argv, command, args):
 
 
 def test_main_hiking_json_loader_exception(mocker, caplog, snapshot):
-    args = ArgsMock(command="import", json_data=[{"foo": "bar"}])
+    args = ArgsMock(
+        command="import", json_data=[{"foo": "bar"}], workers=1, batch_size=1
+    )
     mocker.patch.object(
         __main__,
         "parse_arguments",
@@ -92,3 +121,37 @@ def test_main_hiking_exception(mocker, caplog, snapshot):
     main()
     assert len(caplog.messages) == 1
     assert caplog.messages[0] == snapshot
+
+
+def test_show_import_time(tmp_path):
+    env = {**os.environ, "XDG_DATA_HOME": str(tmp_path)}
+    env.pop("HIKING_TEST")
+    json_file = Path(__file__).parent / "data" / "test_import.json"
+
+    def run(*args):
+        return subprocess.run(  # noqa: S603
+            [sys.executable, *args],
+            env=env,
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+
+    run("-m", "hiking", "import", str(json_file), "--workers=1")
+    result = run("-X", "importtime", "-m", "hiking", "show")
+
+    assert "endorsement" in result.stdout
+
+    # "import time: <self us> | <cumulative us> | <module>"
+    imports = [
+        line.removeprefix("import time:").split("|")
+        for line in result.stderr.splitlines()
+        if line.startswith("import time:") and "[us]" not in line
+    ]
+    modules = {module.strip() for *_, module in imports}
+    for heavy_module in ["gpxpy", "plotille", "rich.markdown", "rich.progress"]:
+        assert heavy_module not in modules
+    assert {
+        module for module in modules if module.split(".")[0] == "hiking"
+    } == SHOW_HIKING_MODULES
+    assert len(imports) < SHOW_IMPORT_BUDGET
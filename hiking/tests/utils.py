@@ -1,7 +1,40 @@
+import datetime
+import random
 import re
 
+from gpxpy.gpx import GPX, GPXTrack, GPXTrackPoint, GPXTrackSegment
+
 ANSI_ESCAPE = re.compile(r"\x1B(?:[@-Z\\-_]|\[[0-?]*[ -/]*[@-~])")
 
 
 def ansi_escape(value: str):
     return ANSI_ESCAPE.sub("", value)
+
+
+def random_gpx(seed: int, tracks: int = 2, segments: int = 2, points: int = 200):
+    """GPX with stops, and points missing elevation or time."""
+    rng = random.Random(seed)  # noqa: S311
+    gpx = GPX()
+    latitude, longitude, elevation = 46.5, 8.0, 1000.0
+    time = datetime.datetime(2020, 1, 1, tzinfo=datetime.UTC)
+    for _ in range(tracks):
+        track = GPXTrack()
+        gpx.tracks.append(track)
+        for _ in range(segments):
+            segment = GPXTrackSegment()
+            track.segments.append(segment)
+            for i in range(points):
+                step = rng.choice([0, 0.00001, 0.0001, 0.0003, 0.3])
+                latitude += step * rng.uniform(-1, 1)
+                longitude += step * rng.uniform(-1, 1)
+                elevation += rng.uniform(-5, 5)
+                time += datetime.timedelta(seconds=rng.choice([0, 1, 10, 30]))
+                segment.points.append(
+                    GPXTrackPoint(
+                        latitude,
+                        longitude,
+                        elevation=round(elevation, 2) if rng.random() > 0.02 else None,
+                        time=time if rng.random() > 0.02 or i in (0, 1) else None,
+                    )
+                )
+    return gpx
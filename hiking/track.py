@@ -0,0 +1,346 @@
+import datetime
+import math
+import struct
+import sys
+from array import array
+from collections import namedtuple
+from collections.abc import Iterator
+from dataclasses import dataclass
+from itertools import accumulate, pairwise
+from typing import BinaryIO, Optional, Union
+from xml.parsers import expat
+
+# Name and `array` typecode of the columns of a track. Distance and elevation don't
+# need more precision than float32, coordinates and timestamps do.
+TRACK_COLUMNS = (
+    ("distance", "f"),
+    ("elevation", "f"),
+    ("time", "d"),
+    ("latitude", "d"),
+    ("longitude", "d"),
+)
+
+# format version and number of points, followed by the number of segments
+HEADER = struct.Struct("<BI")
+SEGMENTS_HEADER = struct.Struct("<I")
+FORMAT_VERSION = 2
+
+# Same as gpxpy, to get the same distances
+EARTH_RADIUS = 6378.137 * 1000
+# Speed (km/h) below which a hike counts as stopped, same as gpxpy
+STOPPED_SPEED_THRESHOLD = 1
+
+
+def get_distances(latitude: array, longitude: array, elevation: array) -> list[float]:
+    """
+    Haversine distance in meters between consecutive points.
+
+    The distance is 3D, unless the elevation of a point is missing.
+    """
+    lat = [math.radians(value) for value in latitude]
+    lon = [math.radians(value) for value in longitude]
+    cos_lat = [math.cos(value) for value in lat]
+
+    distances = []
+    for i in range(1, len(lat)):
+        a = (
+            math.sin((lat[i] - lat[i - 1]) / 2) ** 2
+            + math.sin((lon[i] - lon[i - 1]) / 2) ** 2 * cos_lat[i] * cos_lat[i - 1]
+        )
+        distance = 2 * EARTH_RADIUS * math.asin(math.sqrt(a))
+        ele_diff = elevation[i] - elevation[i - 1]
+        if not math.isnan(ele_diff):
+            distance = math.hypot(distance, ele_diff)
+        distances.append(distance)
+    return distances
+
+
+def smooth(elevations: list[float]) -> list[float]:
+    """Weigh each elevation with its neighbours, like gpxpy."""
+    if len(elevations) < 3:
+        return elevations
+    return [
+        elevations[0],
+        *(
+            previous * 0.3 + current * 0.4 + following * 0.3
+            for previous, current, following in zip(
+                elevations, elevations[1:], elevations[2:], strict=False
+            )
+        ),
+        elevations[-1],
+    ]
+
+
+@dataclass
+class Track:
+    """
+    Columnar representation of the points of a GPX track.
+
+    `distance` is the cumulative 3D distance from start in meters and `time` a
+    POSIX timestamp. Missing elevations and timestamps are stored as `NaN`.
+    `segments` holds the index of the first point of every segment.
+
+    The metrics are computed on the columns, giving the same results as the
+    respective methods of a `gpxpy.gpx.GPX`.
+    """
+
+    distance: array
+    elevation: array
+    time: array
+    latitude: array
+    longitude: array
+    segments: array
+
+    def __len__(self) -> int:
+        return len(self.distance)
+
+    @classmethod
+    def from_points(
+        cls,
+        elevation: array,
+        time: array,
+        latitude: array,
+        longitude: array,
+        segments: array,
+    ) -> "Track":
+        """Track of the given points, deriving `distance`."""
+        # segments don't connect, like in `gpx.get_points_data()`
+        bounds = pairwise([*segments, len(latitude)])
+        distance = array(
+            "f",
+            accumulate(
+                distance
+                for start, end in bounds
+                for distance in (
+                    0,
+                    *get_distances(
+                        latitude[start:end],
+                        longitude[start:end],
+                        elevation[start:end],
+                    ),
+                )
+            ),
+        )
+        return cls(distance, elevation, time, latitude, longitude, segments)
+
+    def iter_segments(self) -> Iterator[tuple[int, int]]:
+        """Start and end index of the points of every segment."""
+        return pairwise([*self.segments, len(self)])
+
+    def length_3d(self) -> float:
+        return float(self.distance[-1]) if len(self) else 0.0
+
+    def get_uphill_downhill(self) -> tuple[float, float]:
+        uphill = downhill = 0.0
+        for start, end in self.iter_segments():
+            elevations = [
+                elevation
+                for elevation in self.elevation[start:end]
+                if not math.isnan(elevation)
+            ]
+            for previous, current in pairwise(smooth(elevations)):
+                if current > previous:
+                    uphill += current - previous
+                else:
+                    downhill += previous - current
+        return uphill, downhill
+
+    def get_duration(self) -> Optional[float]:
+        """
+        Sum of the durations of the segments, `None` if no segment has timestamps.
+
+        Segments without timestamps, or ending before they start, count as 0. For
+        these, gpxpy has no duration for the whole GPX.
+        """
+        duration = 0.0
+        timed = untimed = False
+        for start, end in self.iter_segments():
+            if end - start < 2:
+                continue
+            # gpxpy tolerates a missing timestamp on the first and the last point
+            first, last = self.time[start], self.time[end - 1]
+            if math.isnan(first):
+                first = self.time[start + 1]
+            if math.isnan(last):
+                last = self.time[end - 2]
+            if math.isnan(first) or math.isnan(last) or last < first:
+                untimed = True
+                continue
+            timed = True
+            duration += last - first
+        return None if untimed and not timed else duration
+
+    def get_moving_time(
+        self, stopped_speed_threshold: float = STOPPED_SPEED_THRESHOLD
+    ) -> float:
+        """Seconds spent between points faster than `stopped_speed_threshold`."""
+        moving_time = 0.0
+        for start, end in self.iter_segments():
+            # not derived from `distance`, lacking precision on long tracks
+            distances = get_distances(
+                self.latitude[start:end],
+                self.longitude[start:end],
+                self.elevation[start:end],
+            )
+            times = self.time[start:end]
+            for distance, previous, current in zip(
+                distances, times, times[1:], strict=False
+            ):
+                seconds = current - previous
+                # `NaN` comparisons are false, so pairs without time are ignored
+                if (
+                    seconds > 0
+                    and distance
+                    and distance / seconds * 3.6 > stopped_speed_threshold
+                ):
+                    moving_time += seconds
+        return moving_time
+
+    def to_bytes(self) -> bytes:
+        chunks = [
+            HEADER.pack(FORMAT_VERSION, len(self)),
+            SEGMENTS_HEADER.pack(len(self.segments)),
+        ]
+        for column in [
+            *(getattr(self, name) for name, _ in TRACK_COLUMNS),
+            self.segments,
+        ]:
+            if sys.byteorder == "big":  # pragma: no cover
+                column = array(column.typecode, column)
+                column.byteswap()
+            chunks.append(column.tobytes())
+        return b"".join(chunks)
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "Track":
+        version, length = HEADER.unpack_from(data)
+        if version > FORMAT_VERSION:  # pragma: no cover
+            msg = f"Unsupported track format version: {version}"
+            raise ValueError(msg)
+
+        offset = HEADER.size
+        segments_count = 0
+        if version > 1:
+            (segments_count,) = SEGMENTS_HEADER.unpack_from(data, offset)
+            offset += SEGMENTS_HEADER.size
+
+        columns = {}
+        view = memoryview(data)
+        for name, typecode, count in [
+            *((name, typecode, length) for name, typecode in TRACK_COLUMNS),
+            ("segments", "I", segments_count),
+        ]:
+            column = array(typecode)
+            size = column.itemsize * count
+            column.frombytes(view[offset : offset + size])
+            if sys.byteorder == "big":  # pragma: no cover
+                column.byteswap()
+            columns[name] = column
+            offset += size
+        if version == 1:
+            # tracks without segments are read as a single segment
+            columns["segments"] = array("I", [0] if length else [])
+        return cls(**columns)
+
+
+# Name and time from the metadata of GPX data, and its track
+GPXInfo = namedtuple(  # noqa: PYI024
+    "GPXInfo", ["name", "time", "track"]
+)
+
+
+class GPXReader:
+    """
+    Read the track points of GPX data, streaming it with expat.
+
+    Contrary to `gpxpy.parse`, no object is created per point, the memory needed
+    is the one of the track columns.
+    """
+
+    def __init__(self):
+        self.columns = {
+            name: array(typecode)
+            for name, typecode in TRACK_COLUMNS
+            if name != "distance"
+        }
+        self.segments = array("I")
+        self.metadata = {}
+        # local names of the currently open elements
+        self.path = []
+        self.text = []
+
+        self.parser = expat.ParserCreate()
+        self.parser.StartElementHandler = self.start_element
+        self.parser.EndElementHandler = self.end_element
+        self.parser.CharacterDataHandler = self.character_data
+        self.parser.buffer_text = True
+
+    @staticmethod
+    def parse_value(name: str, value: str) -> Union[float, datetime.datetime]:
+        try:
+            if name == "ele":
+                return float(value)
+            return datetime.datetime.fromisoformat(value)
+        except ValueError as e:
+            msg = f"Invalid value for <{name}>: {value}"
+            raise ValueError(msg) from e
+
+    def start_element(self, name: str, attributes: dict):
+        # namespaces aren't processed, GPX data isn't mixed with other vocabularies
+        name = name.rpartition(":")[2]
+        self.path.append(name)
+        self.text.clear()
+        if name == "trkseg":
+            self.segments.append(len(self.columns["latitude"]))
+        elif name == "trkpt":
+            try:
+                self.columns["latitude"].append(float(attributes["lat"]))
+                self.columns["longitude"].append(float(attributes["lon"]))
+            except (KeyError, ValueError) as e:
+                msg = f"Invalid <trkpt> coordinates: {attributes}"
+                raise ValueError(msg) from e
+            self.columns["elevation"].append(math.nan)
+            self.columns["time"].append(math.nan)
+
+    def end_element(self, _name: str):
+        name = self.path.pop()
+        parent = self.path[-1] if self.path else None
+        value = "".join(self.text).strip()
+        if name == "trkseg" and self.segments[-1] == len(self.columns["latitude"]):
+            # gpxpy keeps empty segments, they don't change the metrics
+            self.segments.pop()
+        elif not value or name not in ("ele", "time", "name"):
+            return
+        elif parent == "trkpt" and name == "ele":
+            self.columns["elevation"][-1] = self.parse_value(name, value)
+        elif parent == "trkpt" and name == "time":
+            self.columns["time"][-1] = self.parse_value(name, value).timestamp()
+        elif parent in ("gpx", "metadata") and name not in self.metadata:
+            self.metadata[name] = (
+                value if name == "name" else self.parse_value(name, value)
+            )
+
+    def character_data(self, data: str):
+        if self.path[-1] in ("ele", "time", "name"):
+            self.text.append(data)
+
+    def read(self, data: Union[str, bytes, BinaryIO]) -> "GPXInfo":
+        """Read `data`, raising a `ValueError` if it isn't valid GPX."""
+        try:
+            if isinstance(data, (str, bytes)):
+                self.parser.Parse(data, True)
+            else:
+                self.parser.ParseFile(data)
+        except expat.ExpatError as e:
+            msg = f"Error parsing XML: {e}"
+            raise ValueError(msg) from e
+
+        return GPXInfo(
+            self.metadata.get("name"),
+            self.metadata.get("time"),
+            Track.from_points(**self.columns, segments=self.segments),
+        )
+
+
+def read_gpx(data: Union[str, bytes, BinaryIO]) -> GPXInfo:
+    return GPXReader().read(data)
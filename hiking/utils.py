@@ -16,6 +16,15 @@ DATA_HOME = (
 
 DB_PATH = DATA_HOME / "hikes.sqlite"
 EDITOR = os.environ.get("EDITOR", "vi")
+# Compression of stored GPX data: "zlib" or "lzma"
+GPX_COMPRESSION = os.environ.get("HIKING_GPX_COMPRESSION", "zlib")
+# SQLite pragmas: a profile of `hiking.db_utils.DB_PROFILES` and overrides of
+# single pragmas as "name=value,..."
+DB_PROFILE = os.environ.get("HIKING_DB_PROFILE", "interactive")
+DB_PRAGMAS = os.environ.get("HIKING_DB_PRAGMAS", "")
+# Tracks read from GPX data, cached by content hash. The size limit is in MiB.
+CACHE_DIR = DATA_HOME / "cache"
+CACHE_SIZE = os.environ.get("HIKING_CACHE_SIZE", "256")
 GPX_VIEWER = "/usr/bin/gpxsee"
 DEFAULT_BOX_STYLE = box.HORIZONTALS
 console = Console()
@@ -35,6 +44,9 @@ def setup_logging(debug: bool):
     logging.getLogger("sqlalchemy.engine").setLevel(
         logging.INFO if debug else logging.WARNING
     )
+    logging.getLogger("hiking.query_plan").setLevel(
+        logging.DEBUG if debug else logging.WARNING
+    )
 
 
 def pretty_timedelta(value: datetime.timedelta) -> str: